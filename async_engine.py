@@ -0,0 +1,309 @@
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+import pytz
+from config import (
+    HTTP_BACKOFF_FACTOR,
+    HTTP_CONNECT_TIMEOUT_SECONDS,
+    HTTP_MAX_RETRIES,
+    HTTP_POOL_MAXSIZE,
+    HTTP_READ_TIMEOUT_SECONDS,
+    METRICS_ENABLED,
+)
+from inflow import PAGE_SIZE
+from rate_limit import PRIORITY_BULK, PRIORITY_WEBHOOK, PRIORITY_WRITE
+from salesforce import (
+    ENRICHED_ORDER_FIELDS,
+    SOBJECT_COLLECTION_SIZE,
+    SOQL_IN_CHUNK_SIZE,
+)
+from shipments import is_shipped, shipment_update
+from transport import RETRY_METHODS, RETRY_STATUSES, record_request
+from utils import chunked
+import logging
+
+# Optional engine, install aiohttp to use it
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def query_params(params):
+    # aiohttp only takes strings, so encode the way requests does
+    return {key: str(value) for key, value in params.items() if value is not None}
+
+
+def backoff_delay(attempt, headers=None):
+    retry_after = (headers or {}).get("Retry-After")
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return HTTP_BACKOFF_FACTOR * 2**attempt + random.uniform(0, HTTP_BACKOFF_FACTOR)
+
+
+# Async counterparts of the Inflow and Salesforce REST calls, sharing one
+# connection pool on a single event loop. Parsing, order mapping, the catalog
+# cache and the Inflow rate limiter are reused from the threaded classes.
+class AsyncEngine:
+    def __init__(self, inflow, salesforce) -> None:
+        if aiohttp is None:
+            raise RuntimeError("The async engine needs aiohttp: pip install aiohttp")
+        self.inflow = inflow
+        self.salesforce = salesforce
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_MAXSIZE),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=HTTP_CONNECT_TIMEOUT_SECONDS,
+                sock_read=HTTP_READ_TIMEOUT_SECONDS,
+            ),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def request(
+        self, method, url, headers, limiter=None, priority=PRIORITY_BULK, **kwargs
+    ):
+        # Same retry policy as transport: retry idempotent methods on
+        # RETRY_STATUSES and connection errors, honouring Retry-After
+        sent = len(kwargs.get("data") or b"")
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            if limiter is not None:
+                await asyncio.sleep(limiter.reserve(priority))
+            started_at = time.perf_counter()
+            try:
+                async with self.session.request(
+                    method, url, headers=headers, **kwargs
+                ) as response:
+                    body = await response.read()
+                    status, response_headers = response.status, response.headers
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if METRICS_ENABLED:
+                    record_request(method, url, time.perf_counter() - started_at)
+                if attempt == HTTP_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            if METRICS_ENABLED:
+                seconds = time.perf_counter() - started_at
+                record_request(method, url, seconds, status, sent, len(body))
+            if limiter is not None:
+                limiter.update_from_response(status, response_headers)
+            if (
+                status in RETRY_STATUSES
+                and method in RETRY_METHODS
+                and attempt < HTTP_MAX_RETRIES
+            ):
+                await asyncio.sleep(backoff_delay(attempt, response_headers))
+                continue
+            return status, response_headers, body
+
+    async def inflow_request(self, method, path, priority, **kwargs):
+        return await self.request(
+            method,
+            f"{self.inflow.url}/{path}",
+            self.inflow.request_headers,
+            self.inflow.rate_limiter,
+            priority,
+            **kwargs,
+        )
+
+    async def get_inflow_page(self, resource, params):
+        _, headers, body = await self.inflow_request(
+            "GET", resource, PRIORITY_BULK, params=query_params(params)
+        )
+        return headers, json.loads(body)
+
+    async def get_inflow_keyset_pages(self, resource, id_key):
+        records = []
+        after = None
+        while True:
+            params = {"count": PAGE_SIZE, "after": after}
+            _, page = await self.get_inflow_page(resource, params)
+            records.extend(page)
+            if len(page) < PAGE_SIZE:
+                return records
+            after = page[-1][id_key]
+
+    async def get_inflow_records(self, resource, id_key):
+        # Partitioned like Inflow.iter_pages, with every page in flight at once
+        params = {"count": PAGE_SIZE, "skip": 0, "sort": id_key, "includeCount": True}
+        headers, first_page = await self.get_inflow_page(resource, params)
+        total = headers.get("X-listCount")
+        if total is None:
+            return await self.get_inflow_keyset_pages(resource, id_key)
+        total = int(total)
+        pages = await asyncio.gather(
+            *(
+                self.get_inflow_page(resource, {**params, "skip": skip})
+                for skip in range(PAGE_SIZE, total, PAGE_SIZE)
+            )
+        )
+        records = first_page + [r for _, page in pages for r in page]
+        if len({r[id_key] for r in records}) != total:
+            logger.warning(f"Inflow {resource} changed while paging, walking again")
+            return await self.get_inflow_keyset_pages(resource, id_key)
+        return records
+
+    async def get_inflow_products(self):
+        try:
+            records = await self.get_inflow_records("products", "productId")
+            return {r["sku"]: self.inflow.parse_product(r) for r in records}
+        except Exception as e:
+            logger.error(f"Error getting inflow products: {e}")
+
+    async def get_inflow_order(self, salesOrderId):
+        try:
+            _, _, body = await self.inflow_request(
+                "GET",
+                f"sales-orders/{salesOrderId}",
+                PRIORITY_WEBHOOK,
+                params={"include": "shipLines"},
+            )
+            return json.loads(body)
+        except Exception as e:
+            logger.error(f"Error getting inflow order: {e}")
+
+    async def create_inflow_order(self, body):
+        order_number = body.get("orderNumber")
+        try:
+            status, _, content = await self.inflow_request(
+                "PUT", "sales-orders", PRIORITY_WRITE, data=json.dumps(body).encode()
+            )
+            if status == 200:
+                logger.info(f"Inflow order successfully created: {order_number}")
+                return True, order_number, content
+            logger.error(f"Inflow order was not created: {status} {content}")
+            return False, order_number, content
+        except Exception as e:
+            logger.error(f"Error creating inflow order: {e}")
+            return False, order_number, e
+
+    @property
+    def salesforce_headers(self):
+        return {
+            "Authorization": f"Bearer {self.salesforce.sf.session_id}",
+            "Content-Type": "application/json",
+        }
+
+    async def salesforce_get(self, url, params=None):
+        status, _, body = await self.request(
+            "GET", url, self.salesforce_headers, params=params
+        )
+        if status != 200:
+            raise Exception(f"{status} {body}")
+        return json.loads(body)
+
+    def salesforce_url(self, path):
+        # nextRecordsUrl comes back relative to the instance
+        parts = urlsplit(self.salesforce.sf.base_url)
+        return f"{parts.scheme}://{parts.netloc}{path}"
+
+    async def query_all(self, query):
+        base_url = self.salesforce.sf.base_url
+        result = await self.salesforce_get(f"{base_url}query", {"q": query})
+        records = result["records"]
+        while not result["done"]:
+            result = await self.salesforce_get(
+                self.salesforce_url(result["nextRecordsUrl"])
+            )
+            records.extend(result["records"])
+        return records
+
+    async def get_all_child_records(self, child_result):
+        if child_result is None:
+            return []
+        records = child_result["records"]
+        while not child_result["done"]:
+            child_result = await self.salesforce_get(
+                self.salesforce_url(child_result["nextRecordsUrl"])
+            )
+            records.extend(child_result["records"])
+        return records
+
+    async def get_orders_by_ids(self, order_ids):
+        try:
+            now = datetime.now(pytz.utc)
+            queries = []
+            for chunk in chunked(list(order_ids), SOQL_IN_CHUNK_SIZE):
+                ids = ", ".join(f"'{order_id}'" for order_id in chunk)
+                queries.append(
+                    f"""
+                    SELECT {ENRICHED_ORDER_FIELDS}
+                    FROM Order
+                    WHERE Id IN ({ids})
+                    AND Status = 'Approved to Ship'
+                    """
+                )
+            results = await asyncio.gather(*(self.query_all(q) for q in queries))
+            orders = [order for records in results for order in records]
+            order_items = await asyncio.gather(
+                *(self.get_all_child_records(order["OrderItems"]) for order in orders)
+            )
+            for order, items in zip(orders, order_items):
+                order["OrderItems"] = items
+            bodies = self.salesforce.build_inflow_order_bodies(orders, now)
+            return bodies, len(bodies) > 0
+        except Exception as e:
+            logger.error(f"Error getting orders {order_ids}: {e}")
+            return [], False
+
+    async def update_order_status_chunk(self, chunk):
+        url = f"{self.salesforce.sf.base_url}composite/sobjects"
+        records = [
+            {
+                "attributes": {"type": "Order"},
+                "id": order_id,
+                "Status": "Shipped",
+                "Tracking_Number_s__c": tracking_numbers,
+            }
+            for order_id, tracking_numbers, _ in chunk
+        ]
+        payload = json.dumps({"allOrNone": False, "records": records}).encode()
+        try:
+            status, _, body = await self.request(
+                "PATCH", url, self.salesforce_headers, data=payload
+            )
+            if status != 200:
+                raise Exception(f"{status} {body}")
+            results = []
+            for (_, _, order_number), result in zip(chunk, json.loads(body)):
+                if result["success"]:
+                    results.append((True, order_number, "success"))
+                else:
+                    logger.error(f"Failed to update order {order_number}: {result}")
+                    results.append((False, order_number, result["errors"]))
+            return results
+        except Exception as e:
+            logger.error(f"Error updating orders: {e}")
+            return [(False, order_number, e) for _, _, order_number in chunk]
+
+    async def update_order_statuses(self, updates):
+        chunks = await asyncio.gather(
+            *(
+                self.update_order_status_chunk(chunk)
+                for chunk in chunked(updates, SOBJECT_COLLECTION_SIZE)
+            )
+        )
+        return [result for results in chunks for result in results]
+
+    async def fulfil_shipments(self, sales_order_ids):
+        # Fetch every order at once, then send the shipped ones in collections
+        responses = await asyncio.gather(
+            *(self.get_inflow_order(i) for i in sales_order_ids)
+        )
+        updates = [shipment_update(r) for r in responses if r and is_shipped(r)]
+        return await self.update_order_statuses(updates)
@@ -0,0 +1,129 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cursors import CursorStore
+from inflow import Inflow
+from salesforce import SalesForce
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_EVERY = 200
+# Its own file: CursorStore rewrites the whole file from memory, so sharing
+# the service's would have each process erase the other's cursors
+checkpoint_store = CursorStore("backfill_cursors")
+
+
+def checkpoint_stream(where_clause):
+    return f"backfill_customers:{where_clause or '*'}"
+
+
+def backfill_customers(sf, inflow, where_clause=None, workers=8, dry_run=False):
+    stream = checkpoint_stream(where_clause)
+    last_id = checkpoint_store.get(stream)
+    filters = [f for f in (where_clause, last_id and f"Id > '{last_id}'") if f]
+    query = "SELECT Id, Name FROM Account"
+    if filters:
+        query += " WHERE " + " AND ".join(f"({f})" for f in filters)
+    query += " ORDER BY Id"
+    if last_id:
+        logger.info(f"Resuming customer backfill after {last_id}")
+
+    inflow_customers = inflow.get_inflow_customers()
+    if inflow_customers is None:
+        # Without the existing names every Account would be created again
+        raise RuntimeError("Could not load inflow customers, backfill aborted")
+    existing_names = set(inflow_customers)
+    stats = {"scanned": 0, "created": 0, "existing": 0, "failed": 0}
+    started_at = time.perf_counter()
+    # Once a create fails the checkpoint stops at the account before it, so a
+    # rerun retries that account and everything after
+    first_failure = {"seen": False, "resume_id": None}
+
+    def create(body):
+        is_successful, name, message = inflow.create_inflow_customer(body)
+        if not is_successful:
+            logger.error(f"Backfill could not create {name}: {message}")
+        return is_successful
+
+    def flush(pending, checkpoint_id):
+        if pending and not dry_run:
+            bodies = [body for _, body in pending]
+            results = list(executor.map(create, bodies))
+            stats["created"] += sum(results)
+            stats["failed"] += len(results) - sum(results)
+            for (previous_id, body), is_successful in zip(pending, results):
+                if is_successful:
+                    continue
+                # Let a later account with the same name try again
+                existing_names.discard(body["name"])
+                if not first_failure["seen"]:
+                    first_failure.update(seen=True, resume_id=previous_id)
+        elif pending:
+            stats["created"] += len(pending)
+        # Every account up to here has been written, so a rerun can skip them
+        if checkpoint_id and not dry_run and not first_failure["seen"]:
+            checkpoint_store.set(stream, checkpoint_id)
+        elapsed = time.perf_counter() - started_at
+        logger.info(
+            f"Backfill progress: {stats}, "
+            f"{stats['scanned'] / elapsed:.1f} accounts/sec"
+        )
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        checkpoint_id = last_id
+        for account in sf.sf.query_all_iter(query):
+            stats["scanned"] += 1
+            previous_id, checkpoint_id = checkpoint_id, account["Id"]
+            name = account["Name"]
+            if name in existing_names:
+                stats["existing"] += 1
+            else:
+                existing_names.add(name)
+                pending.append((previous_id, sf.build_inflow_customer_body(name)))
+            if stats["scanned"] % CHECKPOINT_EVERY == 0:
+                flush(pending, checkpoint_id)
+                pending = []
+        flush(pending, checkpoint_id)
+
+    if first_failure["seen"]:
+        resume_id = first_failure["resume_id"]
+        checkpoint_store.set(stream, resume_id)
+        logger.warning(
+            f"{stats['failed']} customers failed, checkpoint kept at "
+            f"{resume_id or 'the start'} so a rerun retries them"
+        )
+
+    elapsed = time.perf_counter() - started_at
+    stats["elapsed_seconds"] = round(elapsed, 2)
+    stats["accounts_per_second"] = round(stats["scanned"] / elapsed, 1)
+    stats["created_per_second"] = round(stats["created"] / elapsed, 1)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create every Salesforce Account that is missing in Inflow."
+    )
+    parser.add_argument(
+        "--where", help="extra SOQL filter on Account, e.g. \"BillingCountry = 'SG'\""
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore the saved checkpoint"
+    )
+    args = parser.parse_args()
+    if args.restart:
+        checkpoint_store.set(checkpoint_stream(args.where), None)
+    # The backfill never maps orders, so skip loading the product catalog
+    inflow = Inflow(warm_catalog=False)
+    sf = SalesForce(inflow)
+    stats = backfill_customers(sf, inflow, args.where, args.workers, args.dry_run)
+    logger.info(f"Customer backfill finished: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Threaded requests stack vs the asyncio engine, against the local fakes.
+
+Runs the same work both ways at the same concurrency and reports wall time,
+throughput, peak thread count and peak RSS. Needs aiohttp.
+
+    python benchmarks/bench_async.py --concurrency 200 --latency-ms 50
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_servers import FakeInflow, FakeSalesforce  # noqa: E402
+from run import BenchSalesforceClient  # noqa: E402
+
+
+def client_threads():
+    # The fakes run in-process, so leave out their per-connection threads
+    return sum(
+        "process_request_thread" not in thread.name for thread in threading.enumerate()
+    )
+
+
+class ThreadSampler:
+    def __init__(self) -> None:
+        self.peak = client_threads()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while self.running:
+            self.peak = max(self.peak, client_threads())
+            time.sleep(0.005)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.running = False
+        self.thread.join()
+
+
+def measure(fn):
+    with ThreadSampler() as sampler:
+        started_at = time.perf_counter()
+        operations = fn()
+        elapsed = time.perf_counter() - started_at
+    rss_mib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return operations, elapsed, sampler.peak, rss_mib
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=400)
+    parser.add_argument("--shipments", type=int, default=400)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    latency_seconds = args.latency_ms / 1000
+    fake_inflow = FakeInflow(args.products, latency_seconds=latency_seconds).start()
+    fake_salesforce = FakeSalesforce(
+        args.orders, latency_seconds=latency_seconds
+    ).start()
+    os.environ.update(
+        {
+            "INFLOW_BASE_URL": fake_inflow.url,
+            "INFLOW_COMPANY_ID": "bench",
+            "INFLOW_TOKEN": "bench",
+            "STATE_DIR": tempfile.mkdtemp(prefix="bench-state-"),
+            "INFLOW_RATE_LIMIT_PER_MINUTE": "6000000",
+            "INFLOW_RATE_LIMIT_BURST": "100000",
+            "INFLOW_PAGE_WORKERS": str(args.concurrency),
+            "HTTP_POOL_MAXSIZE": str(args.concurrency),
+        }
+    )
+    import logging
+
+    logging.disable(logging.WARNING)
+    from async_engine import AsyncEngine
+    from inflow import Inflow
+    from salesforce import SalesForce
+
+    inflow = Inflow()
+    sf = SalesForce(inflow, BenchSalesforceClient(fake_salesforce.url))
+    order_ids = [order["Id"] for order in fake_salesforce.orders]
+    sales_order_ids = [f"{i:012d}" for i in range(args.shipments)]
+
+    def threaded_order_build():
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            results = executor.map(lambda i: sf.fetch_orders_by_ids([i]), order_ids)
+            return sum(len(bodies) for bodies in results)
+
+    def threaded_shipments():
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            responses = list(executor.map(inflow.get_inflow_order, sales_order_ids))
+        updates = [
+            [r["customFields"]["custom1"], "", r["orderNumber"]] for r in responses
+        ]
+        return len(sf.update_order_statuses(updates))
+
+    def threaded_catalog():
+        return len(inflow.get_inflow_products())
+
+    async def run_async(work):
+        async with AsyncEngine(inflow, sf) as engine:
+            return await work(engine)
+
+    async def gather_order_build(engine):
+        # A semaphore caps in-flight builds like the thread pool does
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def build(order_id):
+            async with semaphore:
+                bodies, _ = await engine.get_orders_by_ids([order_id])
+                return len(bodies)
+
+        return sum(await asyncio.gather(*(build(i) for i in order_ids)))
+
+    async def gather_shipments(engine):
+        return len(await engine.fulfil_shipments(sales_order_ids))
+
+    async def gather_catalog(engine):
+        return len(await engine.get_inflow_products())
+
+    scenarios = [
+        ("order_build", threaded_order_build, gather_order_build),
+        ("shipments", threaded_shipments, gather_shipments),
+        ("catalog", threaded_catalog, gather_catalog),
+    ]
+    print(
+        f"{'scenario':<14}{'engine':<10}{'ops':>8}{'seconds':>10}{'ops/sec':>10}"
+        f"{'threads':>9}{'peak MiB':>10}"
+    )
+    for name, threaded, coroutine in scenarios:
+        runs = [
+            ("threads", threaded),
+            ("asyncio", lambda: asyncio.run(run_async(coroutine))),
+        ]
+        for engine, fn in runs:
+            operations, elapsed, threads, rss_mib = measure(fn)
+            print(
+                f"{name:<14}{engine:<10}{operations:>8}{elapsed:>10.2f}"
+                f"{operations / elapsed:>10.1f}{threads:>9}{rss_mib:>10.1f}"
+            )
+    fake_inflow.stop()
+    fake_salesforce.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Orders/sec for turning enriched Salesforce Orders into Inflow bodies.
+
+    python benchmarks/bench_order_mapping.py --orders 2000 --lines 10
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from order_mapping import MappingContext, transform_order  # noqa: E402
+from sku_index import SkuIndex  # noqa: E402
+
+
+def synthetic_orders(orders, lines_per_order, catalog_size):
+    enriched = []
+    for o in range(orders):
+        order_id = f"801{o:015d}"
+        items = [
+            {
+                "ListPrice": 10.0,
+                "Quantity": 1.0,
+                "Product2Id": f"01t{p:015d}",
+                "Product_Code__c": f"SKU-{p:05d}",
+                "OrderId": order_id,
+            }
+            for p in random.sample(range(catalog_size), lines_per_order)
+        ]
+        enriched.append(
+            {
+                "Id": order_id,
+                "OrderNumber": f"{o:08d}",
+                "ShippingAddress": (
+                    None
+                    if o % 10 == 0
+                    else {
+                        "street": "1 Main St",
+                        "city": "Singapore",
+                        "state": None,
+                        "country": "SG",
+                        "postalCode": "000001",
+                    }
+                ),
+                "Account": {"Name": f"Company {o % 50}", "Website": None},
+                "ShipToContact": {"Email": "a@b.c", "Name": "A", "Phone": None},
+                "OrderItems": items,
+            }
+        )
+    return enriched
+
+
+def synthetic_catalog(catalog_size):
+    products = {
+        f"SKU-{p:05d}-R1": {"productId": f"p{p}", "activeRevision": "Yes"}
+        for p in range(catalog_size)
+    }
+    customers = {f"Company {c}": f"c{c}" for c in range(50)}
+    return products, customers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--lines", type=int, default=10)
+    parser.add_argument("--catalog", type=int, default=20000)
+    args = parser.parse_args()
+    products, customers = synthetic_catalog(args.catalog)
+    orders = synthetic_orders(args.orders, args.lines, args.catalog)
+    ctx = MappingContext(
+        customers, products, SkuIndex(products), datetime.now(timezone.utc)
+    )
+    started_at = time.perf_counter()
+    bodies = [transform_order(order, ctx) for order in orders]
+    elapsed = time.perf_counter() - started_at
+    lines = sum(len(body["lines"]) for body in bodies)
+    print(
+        f"{len(bodies)} orders, {lines} lines in {elapsed * 1000:.1f} ms: "
+        f"{len(bodies) / elapsed:,.0f} orders/sec"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Per-order cost of turning Salesforce OrderItem records into order lines.
+
+Compares the pandas groupby/merge the SalesForce class used to run with the
+dict-based aggregation in records.py. pandas is optional here and only
+imported when it is installed.
+
+    python benchmarks/bench_records.py --orders 200 --lines 20
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import aggregate_order_lines  # noqa: E402
+
+
+def synthetic_records(orders, lines_per_order, catalog_size):
+    products = [
+        {"attributes": {}, "Id": f"01t{i:015d}", "InFlow__c": True}
+        for i in range(catalog_size)
+    ]
+    order_items = []
+    for o in range(orders):
+        for _ in range(lines_per_order):
+            p = random.randrange(catalog_size)
+            order_items.append(
+                {
+                    "attributes": {},
+                    "ListPrice": 10.0 + p,
+                    "Quantity": float(random.randint(1, 5)),
+                    "Product2Id": f"01t{p:015d}",
+                    "Product_Code__c": f"SKU-{p}",
+                    "OrderId": f"801{o:015d}",
+                }
+            )
+    return order_items, products
+
+
+def pandas_aggregate(pd, order_items, products):
+    order_products_df = pd.DataFrame.from_dict(order_items)
+    order_products_df.drop("attributes", axis=1, inplace=True)
+    order_products_df = order_products_df.groupby(
+        ["OrderId", "Product_Code__c"], as_index=False
+    ).agg({"Quantity": "sum", "ListPrice": "first", "Product2Id": "first"})
+    products_df = pd.DataFrame.from_dict(products)
+    products_df.drop("attributes", axis=1, inplace=True)
+    results_df_final = pd.merge(
+        products_df, order_products_df, left_on="Id", right_on="Product2Id"
+    )
+    orders_products_dict = {}
+    for row in results_df_final.itertuples():
+        orders_products_dict.setdefault(row.OrderId, {})[row.Product_Code__c] = {
+            "listPrice": row.ListPrice,
+            "quantity": row.Quantity,
+            "productId": row.Product2Id,
+        }
+    return orders_products_dict
+
+
+def records_aggregate(order_items):
+    return aggregate_order_lines(order_items)
+
+
+def measure(name, fn, orders, repeat):
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - started_at) / repeat
+    print(
+        f"{name:<8} {elapsed * 1000:9.2f} ms/batch "
+        f"{elapsed / orders * 1e6:9.1f} us/order {peak / 1024:9.1f} KiB peak"
+    )
+
+
+def import_seconds(module):
+    code = f"import time; t = time.perf_counter(); import {module}; "
+    code += "print(time.perf_counter() - t)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None
+    return float(result.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=20)
+    parser.add_argument("--catalog", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    order_items, products = synthetic_records(args.orders, args.lines, args.catalog)
+    measure(
+        "records",
+        lambda: records_aggregate(order_items),
+        args.orders,
+        args.repeat,
+    )
+    try:
+        import pandas as pd
+    except ImportError:
+        print("pandas   not installed, skipping baseline")
+        return
+    measure(
+        "pandas",
+        lambda: pandas_aggregate(pd, order_items, products),
+        args.orders,
+        args.repeat,
+    )
+    print(f"import pandas: {import_seconds('pandas'):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Local stand-ins for the Inflow, Salesforce and Slack HTTP APIs.
+
+Each server serves a synthetic dataset, can add latency and answer a share
+of requests with 429, and counts requests per route so scenarios can
+report how many calls they made.
+"""
+
+import json
+import random
+import re
+import socket
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class Server(ThreadingHTTPServer):
+    # The default listen backlog of 5 drops SYNs when a benchmark opens
+    # many connections at once, costing a 1s retransmit each
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class FakeServer:
+    def __init__(self, latency_seconds=0.0, throttle_rate=0.0) -> None:
+        self.latency_seconds = latency_seconds
+        self.throttle_rate = throttle_rate
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers and body go out in separate writes, so without this
+                # Nagle plus delayed ACK adds ~40ms to keep-alive requests
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def handle_any(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                parts = urlsplit(self.path)
+                query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+                if server.latency_seconds:
+                    time.sleep(server.latency_seconds)
+                if server.throttle_rate and random.random() < server.throttle_rate:
+                    server.count(self.command, "429")
+                    self.reply(429, {"error": "rate limited"}, {"Retry-After": "0"})
+                    return
+                route, status, payload, *headers = server.route(
+                    self.command, parts.path, query, body
+                )
+                server.count(self.command, route)
+                self.reply(status, payload, *headers)
+
+            def reply(self, status, payload, headers=None):
+                data = b"" if payload is None else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_PUT = do_POST = do_PATCH = handle_any
+
+        self.httpd = Server(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+    def count(self, method, route):
+        with self.lock:
+            self.requests[f"{method} {route}"] += 1
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests.clear()
+
+    def route(self, method, path, query, body):
+        raise NotImplementedError
+
+
+def inflow_timestamp(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%f") + "0+00:00"
+
+
+class FakeInflow(FakeServer):
+    def __init__(self, products=1000, customers=200, **kwargs) -> None:
+        super().__init__(**kwargs)
+        modified = inflow_timestamp(datetime(2024, 1, 1, tzinfo=timezone.utc))
+        self.products = [
+            {
+                "productId": f"{i:08d}-0000-0000-0000-000000000000",
+                "sku": f"SKU-{i:06d}-R1",
+                "name": f"Product {i}",
+                "lastModifiedDateTime": modified,
+                "customFields": {"custom2": "Yes", "custom3": "10", "custom6": "Yes"},
+            }
+            for i in range(products)
+        ]
+        self.customers = [
+            {"customerId": f"{i:08d}-cust", "name": f"Company {i}"}
+            for i in range(customers)
+        ]
+        self.shipped_at = datetime.now(timezone.utc)
+
+    def page(self, records, id_key, query):
+        count = int(query.get("count", 100))
+        if "skip" in query:
+            start = int(query["skip"])
+        elif query.get("after"):
+            ids = [r[id_key] for r in records]
+            start = ids.index(query["after"]) + 1
+        else:
+            start = 0
+        if query.get("sort") == "lastModifiedDateTime":
+            records = sorted(
+                records,
+                key=lambda r: r["lastModifiedDateTime"],
+                reverse=query.get("sortDesc") == "True",
+            )
+        return records[start : start + count], {"X-listCount": str(len(records))}
+
+    def route(self, method, path, query, body):
+        resource = path.strip("/").split("/")[1:]
+        if method == "GET" and resource == ["products"]:
+            return ("products", 200, *self.page(self.products, "productId", query))
+        if method == "GET" and resource == ["customers"]:
+            return ("customers", 200, *self.page(self.customers, "customerId", query))
+        if method == "PUT" and resource in (["sales-orders"], ["customers"]):
+            return resource[0], 200, json.loads(body)
+        if method == "PUT" and resource == ["webhooks"]:
+            return "webhooks", 200, json.loads(body)
+        if method == "GET" and resource[:1] == ["sales-orders"]:
+            order_id = resource[1]
+            return (
+                "sales-orders/{id}",
+                200,
+                {
+                    "salesOrderId": order_id,
+                    "orderNumber": f"SO-{order_id}",
+                    "isCompleted": True,
+                    "shippedDate": self.shipped_at.isoformat(),
+                    "customFields": {"custom1": f"801{order_id}"},
+                    "shipLines": [{"trackingNumber": f"TRK{order_id}"}],
+                },
+            )
+        return "unknown", 404, {"error": path}
+
+
+class FakeSalesforce(FakeServer):
+    BATCH_SIZE = 2000
+
+    def __init__(self, orders=100, lines_per_order=5, accounts=1000, **kwargs):
+        super().__init__(**kwargs)
+        modstamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000+0000")
+        self.orders = [
+            {
+                "attributes": {"type": "Order"},
+                "Id": f"801{o:015d}",
+                "SystemModstamp": modstamp,
+                "AccountId": f"001{o % 50:015d}",
+                "OrderNumber": f"{o:08d}",
+                "Name": None,
+                "Shipping_Date__c": None,
+                "ShippingAddress": {
+                    "street": "1 Main St",
+                    "city": "Singapore",
+                    "state": None,
+                    "country": "SG",
+                    "postalCode": "000001",
+                },
+                "ShipToContactId": f"003{o:015d}",
+                "Account": {"Name": f"Company {o % 50}", "Website": None},
+                "ShipToContact": {"Email": "a@b.c", "Name": "A", "Phone": None},
+                "OrderItems": {
+                    "done": True,
+                    "totalSize": lines_per_order,
+                    "records": [
+                        {
+                            "ListPrice": 10.0,
+                            "Quantity": 1.0,
+                            "Product2Id": f"01t{p:015d}",
+                            "Product_Code__c": f"SKU-{p:06d}",
+                            "OrderId": f"801{o:015d}",
+                        }
+                        for p in range(o, o + lines_per_order)
+                    ],
+                },
+            }
+            for o in range(orders)
+        ]
+        self.accounts = [
+            {
+                "attributes": {"type": "Account"},
+                "Id": f"001{a:015d}",
+                "Name": f"Company {a}",
+                "CreatedDate": modstamp,
+            }
+            for a in range(accounts)
+        ]
+        self.cursors = {}
+
+    def query(self, soql):
+        records = self.orders if re.search(r"FROM Order\s", soql) else self.accounts
+        after = re.search(r"Id > '(\w+)'", soql)
+        if after:
+            records = [r for r in records if r["Id"] > after.group(1)]
+        ids = re.search(r"Id IN \(([^)]*)\)", soql)
+        if ids:
+            wanted = set(re.findall(r"'(\w+)'", ids.group(1)))
+            records = [r for r in records if r["Id"] in wanted]
+        limit = re.search(r"LIMIT (\d+)", soql)
+        if limit:
+            records = records[: int(limit.group(1))]
+        return records
+
+    def result(self, records, offset):
+        batch = records[offset : offset + self.BATCH_SIZE]
+        done = offset + len(batch) >= len(records)
+        result = {"totalSize": len(records), "done": done, "records": batch}
+        if not done:
+            locator = f"{id(records)}-{offset + len(batch)}"
+            self.cursors[locator] = records
+            result["nextRecordsUrl"] = f"/services/data/v59.0/query/{locator}"
+        return result
+
+    def route(self, method, path, query, body):
+        if method == "GET" and path.endswith("/query"):
+            return "query", 200, self.result(self.query(query["q"]), 0)
+        if method == "GET" and "/query/" in path:
+            locator = path.rsplit("/", 1)[1]
+            offset = int(locator.rsplit("-", 1)[1])
+            return "query_more", 200, self.result(self.cursors[locator], offset)
+        if method == "PATCH" and "/sobjects/Order/" in path:
+            return "sobjects/Order/{id}", 204, None
+        if method == "PATCH" and "/composite/sobjects" in path:
+            records = json.loads(body)["records"]
+            results = [{"id": None, "success": True, "errors": []} for _ in records]
+            return "composite/sobjects", 200, results
+        return "unknown", 404, {"error": path}
+
+
+class FakeSlack(FakeServer):
+    def route(self, method, path, query, body):
+        method_name = path.rsplit("/", 1)[1]
+        return method_name, 200, {"ok": True, "user_id": "U0", "bot_id": "B0"}
@@ -0,0 +1,263 @@
+"""Run integration scenarios against local fake Inflow, Salesforce and Slack.
+
+Reports throughput, p50/p99 latency, requests per route and peak RSS for
+each scenario, e.g.
+
+    python benchmarks/run.py --products 20000 --latency-ms 20 --throttle-rate 0.02
+    python benchmarks/run.py --scenarios webhook_burst --webhooks 500
+"""
+
+import argparse
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_servers import FakeInflow, FakeSalesforce, FakeSlack  # noqa: E402
+
+SCENARIOS = ["catalog_pagination", "order_build", "webhook_burst", "customer_backfill"]
+
+
+class BenchSalesforceClient:
+    # The subset of simple_salesforce.Salesforce the integration uses, pointed
+    # at the fake server over plain HTTP
+    def __init__(self, url) -> None:
+        self.origin = url
+        self.base_url = f"{url}/services/data/v59.0/"
+        self.sf_instance = urlsplit(url).netloc
+        self.session_id = "bench"
+
+    def get(self, url, params=None):
+        import transport
+
+        headers = {"Authorization": f"Bearer {self.session_id}"}
+        return transport.request("GET", url, params=params, headers=headers).json()
+
+    def query(self, query):
+        return self.get(f"{self.base_url}query", {"q": query})
+
+    def query_more(self, next_records_url, identifier_is_url=False):
+        return self.get(f"{self.origin}{next_records_url}")
+
+    def query_all_iter(self, query):
+        result = self.query(query)
+        while True:
+            yield from result["records"]
+            if result["done"]:
+                return
+            result = self.query_more(result["nextRecordsUrl"], True)
+
+    def query_all(self, query):
+        records = list(self.query_all_iter(query))
+        return {"totalSize": len(records), "done": True, "records": records}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_scenario(name, servers, fn):
+    for server in servers:
+        server.reset_counts()
+    started_at = time.perf_counter()
+    operations, latencies = fn()
+    elapsed = time.perf_counter() - started_at
+    requests = {}
+    for server in servers:
+        for route, count in sorted(server.requests.items()):
+            requests[f"{type(server).__name__[4:]} {route}"] = count
+    return {
+        "scenario": name,
+        "operations": operations,
+        "seconds": elapsed,
+        "throughput": operations / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "requests": requests,
+        "peak_rss_mib": peak_rss_mib(),
+    }
+
+
+def timed_calls(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started_at)
+    return latencies
+
+
+def catalog_pagination(args, inflow_module):
+    inflow = inflow_module.Inflow()
+
+    def run():
+        latencies = timed_calls(inflow.get_inflow_products, args.repeat)
+        return args.products * args.repeat, latencies
+
+    return run
+
+
+def order_build(args, sf):
+    from cursors import cursor_store
+    from salesforce import ORDERS_CURSOR_STREAM
+
+    def build():
+        cursor_store.set(ORDERS_CURSOR_STREAM, None)
+        bodies, _, _ = sf.get_latest_order_status_updates()
+        assert len(bodies) == min(args.orders, 2000), len(bodies)
+
+    def run():
+        return args.orders * args.repeat, timed_calls(build, args.repeat)
+
+    return run
+
+
+def webhook_burst(args):
+    import main
+
+    client = main.app.test_client()
+
+    def run():
+        latencies = []
+        for i in range(args.webhooks):
+            started_at = time.perf_counter()
+            response = client.post("/webhook", json={"salesOrderId": f"{i:012d}"})
+            latencies.append(time.perf_counter() - started_at)
+            assert response.status_code == 200, response.status_code
+        main.webhook_queue.queue.join()
+        while main.outbox.depth():
+            time.sleep(0.01)
+        main.slack.flush()
+        return args.webhooks, latencies
+
+    return run
+
+
+def customer_backfill(args, sf, inflow):
+    from backfill import backfill_customers
+
+    def run():
+        stats = backfill_customers(sf, inflow, workers=args.workers)
+        return stats["scanned"], []
+
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=5)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--webhooks", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--inflow-rate-limit",
+        type=float,
+        default=600000,
+        help="requests/minute for the Inflow limiter, high by default to "
+        "measure the client rather than the quota",
+    )
+    args = parser.parse_args()
+
+    fake_kwargs = {
+        "latency_seconds": args.latency_ms / 1000,
+        "throttle_rate": args.throttle_rate,
+    }
+    fake_inflow = FakeInflow(args.products, args.customers, **fake_kwargs).start()
+    fake_salesforce = FakeSalesforce(
+        args.orders, args.lines, args.accounts, **fake_kwargs
+    ).start()
+    fake_slack = FakeSlack().start()
+    servers = [fake_inflow, fake_salesforce, fake_slack]
+
+    # config reads the environment at import, so point it at the fakes first
+    os.environ.update(
+        {
+            "INFLOW_BASE_URL": fake_inflow.url,
+            "INFLOW_COMPANY_ID": "bench",
+            "INFLOW_TOKEN": "bench",
+            "SERVER_URL": "http://127.0.0.1",
+            "SLACK_BOT_TOKEN": "xoxb-bench",
+            "SLACK_APP_TOKEN": "xapp-bench",
+            "SLACK_CHANNEL_ID": "C0",
+            "SLACK_COALESCE_SECONDS": "0.05",
+            "OUTBOX_BATCH_WINDOW_SECONDS": "0.05",
+            "OUTBOX_POLL_SECONDS": "0.05",
+            "STATE_DIR": tempfile.mkdtemp(prefix="bench-state-"),
+            "INFLOW_RATE_LIMIT_PER_MINUTE": str(args.inflow_rate_limit),
+            "INFLOW_RATE_LIMIT_BURST": str(max(int(args.inflow_rate_limit / 60), 1)),
+            "HTTP_BACKOFF_FACTOR": "0.01",
+        }
+    )
+    import logging
+    from slack_sdk.web.base_client import BaseClient
+
+    logging.disable(logging.WARNING)
+    # base_url is bound as a default argument, so wrap the constructor to
+    # send every Slack client, including slack_bolt's, to the fake
+    slack_init = BaseClient.__init__
+
+    def fake_slack_init(self, *args, **kwargs):
+        kwargs.setdefault("base_url", f"{fake_slack.url}/api/")
+        slack_init(self, *args, **kwargs)
+
+    BaseClient.__init__ = fake_slack_init
+    import inflow as inflow_module
+    import salesforce
+
+    salesforce_client = BenchSalesforceClient(fake_salesforce.url)
+    # main builds its own SalesForce, so hand it the fake client as well
+    salesforce.Salesforce = lambda **kwargs: salesforce_client
+    inflow = inflow_module.Inflow()
+    sf = salesforce.SalesForce(inflow, salesforce_client)
+
+    scenarios = {
+        "catalog_pagination": lambda: catalog_pagination(args, inflow_module),
+        "order_build": lambda: order_build(args, sf),
+        "webhook_burst": lambda: webhook_burst(args),
+        "customer_backfill": lambda: customer_backfill(args, sf, inflow),
+    }
+    results = [
+        run_scenario(name, servers, scenarios[name]()) for name in args.scenarios
+    ]
+
+    print(
+        f"{'scenario':<20}{'ops':>8}{'seconds':>10}{'ops/sec':>12}"
+        f"{'p50 ms':>10}{'p99 ms':>10}{'peak MiB':>10}"
+    )
+    for r in results:
+        print(
+            f"{r['scenario']:<20}{r['operations']:>8}{r['seconds']:>10.2f}"
+            f"{r['throughput']:>12.1f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+            f"{r['peak_rss_mib']:>10.1f}"
+        )
+        for route, count in r["requests"].items():
+            print(f"    {route:<40}{count:>8}")
+    for server in servers:
+        server.stop()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
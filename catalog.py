@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+from config import CATALOG_CACHE_MAX_ENTRIES, CATALOG_CACHE_TTL_SECONDS
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PRODUCTS_CACHE_KEY = "inflow_products"
+CUSTOMERS_CACHE_KEY = "inflow_customers"
+
+
+class CatalogCache:
+    def __init__(self, ttl_seconds, max_entries) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def _load_lock(self, key):
+        with self._lock:
+            return self._load_locks.setdefault(key, threading.Lock())
+
+    def peek(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def get(self, key, loader):
+        value = self.peek(key)
+        if value is not None:
+            return value
+        # Only one thread pays for a cold load, the others wait and reuse it
+        with self._load_lock(key):
+            value = self.peek(key)
+            if value is not None:
+                return value
+            logger.info(f"Catalog cache miss, loading {key}")
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                logger.info(f"Catalog cache evicted {evicted_key}")
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+catalog_cache = CatalogCache(CATALOG_CACHE_TTL_SECONDS, CATALOG_CACHE_MAX_ENTRIES)
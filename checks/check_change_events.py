@@ -0,0 +1,138 @@
+"""Publish Order and Account change events through FakeEventSource into
+ChangeEventConsumer, against the local fake Inflow and Salesforce, and check
+what gets delivered, what is replayed and what happens on a Salesforce error.
+
+    python checks/check_change_events.py
+"""
+
+import os
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fake_servers import FakeInflow, FakeSalesforce  # noqa: E402
+from run import BenchSalesforceClient  # noqa: E402
+
+
+def order_event(order_id, status="Approved to Ship", change_type="UPDATE"):
+    header = {"changeType": change_type, "recordIds": [order_id]}
+    return {"ChangeEventHeader": header, "Status": status}
+
+
+def account_event(name, change_type="CREATE"):
+    header = {"changeType": change_type, "recordIds": ["001000000000000000"]}
+    return {"ChangeEventHeader": header, "Name": name}
+
+
+def main():
+    fake_inflow = FakeInflow(products=200, customers=50).start()
+    fake_salesforce = FakeSalesforce(orders=10).start()
+    os.environ.update(
+        {
+            "INFLOW_BASE_URL": fake_inflow.url,
+            "INFLOW_COMPANY_ID": "bench",
+            "INFLOW_TOKEN": "bench",
+            "STATE_DIR": tempfile.mkdtemp(prefix="check-state-"),
+            "HTTP_MAX_RETRIES": "0",
+        }
+    )
+    import logging
+
+    # The dropped event in the last check logs a traceback on purpose
+    logging.disable(logging.CRITICAL)
+    import streaming
+    from cursors import cursor_store
+    from inflow import Inflow
+    from salesforce import SalesForce
+    from streaming import (
+        ACCOUNT_CHANGE_CHANNEL,
+        ORDER_CHANGE_CHANNEL,
+        ChangeEventConsumer,
+        REPLAY_NEW_EVENTS,
+        FakeEventSource,
+    )
+
+    streaming.DISPATCH_RETRY_SECONDS = 0.05
+    sf = SalesForce(Inflow(), BenchSalesforceClient(fake_salesforce.url))
+    order_ids = [order["Id"] for order in fake_salesforce.orders]
+    delivered_orders = []
+    delivered_customers = []
+
+    def on_orders(bodies):
+        delivered_orders.extend(body["orderNumber"] for body in bodies)
+
+    def on_customers(bodies):
+        delivered_customers.extend(body["name"] for body in bodies)
+
+    def replay_cursor(channel):
+        return cursor_store.get(f"replay:{channel}")
+
+    # Retained before anyone subscribes; the first order event was handled by
+    # an earlier run, so only the events after it are replayed
+    source = FakeEventSource()
+    handled = source.publish(ORDER_CHANGE_CHANNEL, order_event(order_ids[0]))
+    source.publish(ORDER_CHANGE_CHANNEL, order_event(order_ids[1]))
+    source.publish(ORDER_CHANGE_CHANNEL, order_event(order_ids[2], status="Draft"))
+    source.publish(ACCOUNT_CHANGE_CHANNEL, account_event("Replayed Co"))
+    cursor_store.set(f"replay:{ORDER_CHANGE_CHANNEL}", handled)
+    cursor_store.set(f"replay:{ACCOUNT_CHANGE_CHANNEL}", 0)
+
+    ChangeEventConsumer(sf, source, on_orders, on_customers).start()
+    source.pending.join()
+    assert delivered_orders == ["SO-00000001"], delivered_orders
+    assert delivered_customers == ["Replayed Co"], delivered_customers
+    assert replay_cursor(ORDER_CHANGE_CHANNEL) == 3
+    assert replay_cursor(ACCOUNT_CHANGE_CHANNEL) == 4
+    print("replay: resumed after the saved replay id on both channels")
+
+    # Live events, including ones the consumer ignores
+    source.publish(ORDER_CHANGE_CHANNEL, order_event(order_ids[3]))
+    source.publish(ORDER_CHANGE_CHANNEL, order_event(order_ids[4], "Draft", "CREATE"))
+    source.publish(ACCOUNT_CHANGE_CHANNEL, account_event("Live Co"))
+    source.publish(ACCOUNT_CHANGE_CHANNEL, account_event("Renamed Co", "UPDATE"))
+    source.pending.join()
+    assert delivered_orders == ["SO-00000001", "SO-00000003"], delivered_orders
+    assert delivered_customers == ["Replayed Co", "Live Co"], delivered_customers
+    assert replay_cursor(ORDER_CHANGE_CHANNEL) == 6
+    assert replay_cursor(ACCOUNT_CHANGE_CHANNEL) == 8
+    print("live: approvals and new accounts delivered, the rest skipped")
+
+    # Salesforce fails the first fetch, the approval must still go through
+    # and the replay id must not move until it has
+    fake_salesforce.throttle_rate = 1.0
+    saved_before = replay_cursor(ORDER_CHANGE_CHANNEL)
+    recovered = threading.Timer(0.02, setattr, (fake_salesforce, "throttle_rate", 0))
+    recovered.start()
+    replay_id = source.publish(ORDER_CHANGE_CHANNEL, order_event(order_ids[5]))
+    source.pending.join()
+    assert fake_salesforce.requests["GET 429"] >= 1, fake_salesforce.requests
+    assert delivered_orders[-1] == "SO-00000005", delivered_orders
+    assert replay_cursor(ORDER_CHANGE_CHANNEL) == replay_id > saved_before
+    print("salesforce error: fetch retried, replay id saved after delivery")
+
+    # A handler that keeps failing never saves its replay id
+    def failing_on_orders(bodies):
+        raise RuntimeError("outbox unavailable")
+
+    consumer = ChangeEventConsumer(sf, source, failing_on_orders, on_customers)
+    source.subscribe(
+        ORDER_CHANGE_CHANNEL, REPLAY_NEW_EVENTS, consumer.handle_order_event
+    )
+    saved_before = replay_cursor(ORDER_CHANGE_CHANNEL)
+    source.publish(ORDER_CHANGE_CHANNEL, order_event(order_ids[6]))
+    source.pending.join()
+    assert replay_cursor(ORDER_CHANGE_CHANNEL) == saved_before
+    print("handler error: replay id left at the last delivered event")
+
+    source.stop()
+    fake_inflow.stop()
+    fake_salesforce.stop()
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
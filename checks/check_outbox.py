@@ -0,0 +1,139 @@
+"""Drain one SQLite outbox from several Outbox instances at once and check
+that leases keep entries from going out twice, that failures back off and
+that entries are dead-lettered after max_attempts.
+
+    python checks/check_outbox.py
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BACKOFF_SECONDS = 0.2
+LEASE_SECONDS = 0.3
+MAX_ATTEMPTS = 3
+
+
+def main():
+    state_dir = tempfile.mkdtemp(prefix="check-state-")
+    os.environ["STATE_DIR"] = state_dir
+    import logging
+
+    # Failed deliveries and dead-lettered entries log errors on purpose
+    logging.disable(logging.CRITICAL)
+    from outbox import Outbox
+
+    path = os.path.join(state_dir, "outbox.sqlite3")
+
+    def open_outbox():
+        return Outbox(
+            path,
+            poll_seconds=1,
+            batch_window_seconds=0,
+            backoff_seconds=BACKOFF_SECONDS,
+            max_backoff_seconds=BACKOFF_SECONDS * 4,
+            lease_seconds=LEASE_SECONDS,
+            max_attempts=MAX_ATTEMPTS,
+        )
+
+    # Four drainers, as in four gunicorn workers, on the same file
+    delivered = Counter()
+    delivered_lock = threading.Lock()
+
+    def deliver_orders(payloads):
+        time.sleep(0.005)
+        with delivered_lock:
+            delivered.update(payload["id"] for payload in payloads)
+        return [(True, payload["id"], "ok") for payload in payloads]
+
+    outboxes = [open_outbox() for _ in range(4)]
+    for outbox in outboxes:
+        outbox.register("inflow_order", deliver_orders, batch_size=10)
+    outboxes[0].add_many("inflow_order", [{"id": i} for i in range(500)])
+    drainers = [threading.Thread(target=outbox.drain) for outbox in outboxes]
+    for drainer in drainers:
+        drainer.start()
+    for drainer in drainers:
+        drainer.join()
+    assert len(delivered) == 500, len(delivered)
+    assert max(delivered.values()) == 1, delivered.most_common(3)
+    assert outboxes[0].depth() == 0
+    print("lease: 500 entries across 4 drainers, each delivered once")
+
+    # A drainer that dies mid-delivery leaves its lease behind; nobody else
+    # picks the entry up until the lease lapses
+    outbox = outboxes[0]
+    outbox.add("inflow_order", {"id": "crashed"})
+    assert len(outbox.claim("inflow_order", 10)) == 1
+    assert outboxes[1].claim("inflow_order", 10) == []
+    time.sleep(LEASE_SECONDS)
+    delivered.clear()
+    outboxes[1].drain()
+    assert delivered == Counter({"crashed": 1}), delivered
+    print("lease: an abandoned entry goes out again once its lease lapses")
+
+    # Every failure pushes the next attempt out, doubling each time
+    results = []
+
+    def fail(payloads):
+        return [(False, payload["id"], "boom") for payload in payloads]
+
+    outbox.register(
+        "salesforce_order_status",
+        fail,
+        on_result=lambda *result: results.append(result),
+    )
+    outbox.add("salesforce_order_status", {"id": "SO-1"})
+    attempts_at = []
+    for attempt in range(MAX_ATTEMPTS - 1):
+        outbox.drain()
+        attempts_at.append(time.time())
+        stats = outbox.stats()["salesforce_order_status"]
+        assert stats["depth"] == 1 and stats["retrying"] == 1, stats
+        ((next_attempt_at,),) = outbox._connection().execute(
+            "SELECT next_attempt_at FROM outbox WHERE kind = ?",
+            ("salesforce_order_status",),
+        )
+        delay = next_attempt_at - attempts_at[-1]
+        full = BACKOFF_SECONDS * 2**attempt
+        assert full * 0.5 - 0.05 <= delay <= full, (attempt, delay)
+        # Not due yet, so another drain leaves it alone
+        outbox.drain()
+        assert len(results) == attempt + 1, results
+        time.sleep(delay)
+    print("backoff: failed entries wait out a growing, jittered delay")
+
+    # The last allowed attempt moves the entry to outbox_dead
+    outbox.drain()
+    stats = outbox.stats()["salesforce_order_status"]
+    assert stats["depth"] == 0 and stats["dead"] == 1, stats
+    assert [attempts for *_, attempts in results] == [0, 1, 2], results
+    ((attempts, last_error),) = outbox._connection().execute(
+        "SELECT attempts, last_error FROM outbox_dead WHERE kind = ?",
+        ("salesforce_order_status",),
+    )
+    assert attempts == MAX_ATTEMPTS and last_error == "boom", (attempts, last_error)
+    print(f"dead letter: given up after {MAX_ATTEMPTS} attempts and kept")
+
+    # A handler that raises, or answers for the wrong number of entries,
+    # fails the whole batch rather than losing any of it
+    def short(payloads):
+        return [(True, payloads[0]["id"], "ok")]
+
+    outbox.register("inflow_customer", short, batch_size=5)
+    outbox.add_many("inflow_customer", [{"id": i} for i in range(3)])
+    outbox.drain()
+    stats = outbox.stats()["inflow_customer"]
+    assert stats["depth"] == 3 and stats["retrying"] == 3, stats
+    print("handler error: the whole batch stays queued for a retry")
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Queue callers of every priority on one RateLimiter and check the order
+they are served in, then check how rate limit headers pause it.
+
+    python checks/check_rate_limit.py
+"""
+
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    import logging
+
+    # Every pause logs a warning on purpose
+    logging.disable(logging.WARNING)
+    from rate_limit import (
+        MAX_PAUSE_SECONDS,
+        PRIORITY_BULK,
+        PRIORITY_WEBHOOK,
+        PRIORITY_WRITE,
+        RateLimiter,
+    )
+
+    # Callers queue up behind an empty bucket, lowest priority first; the
+    # webhook ones still go first, and each priority keeps arrival order
+    limiter = RateLimiter(rate_per_second=20, burst=1)
+    limiter.acquire(PRIORITY_BULK)
+    served = []
+    callers = [
+        (PRIORITY_BULK, "bulk-1"),
+        (PRIORITY_BULK, "bulk-2"),
+        (PRIORITY_WRITE, "write-1"),
+        (PRIORITY_BULK, "bulk-3"),
+        (PRIORITY_WEBHOOK, "webhook-1"),
+        (PRIORITY_WRITE, "write-2"),
+        (PRIORITY_WEBHOOK, "webhook-2"),
+    ]
+
+    def call(priority, name):
+        limiter.acquire(priority)
+        served.append(name)
+
+    threads = []
+    for priority, name in callers:
+        thread = threading.Thread(target=call, args=(priority, name))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.002)
+    stats = limiter.stats()
+    assert stats["queue_depth"] == {"webhook": 2, "write": 2, "bulk": 3}, stats
+    for thread in threads:
+        thread.join()
+    assert served == [
+        "webhook-1",
+        "webhook-2",
+        "write-1",
+        "write-2",
+        "bulk-1",
+        "bulk-2",
+        "bulk-3",
+    ], served
+    print(f"priority: served {', '.join(served)}")
+
+    # Tokens come back at rate_per_second
+    started_at = time.monotonic()
+    for _ in range(5):
+        limiter.acquire(PRIORITY_BULK)
+    elapsed = time.monotonic() - started_at
+    assert 0.2 <= elapsed < 0.4, elapsed
+    print(f"rate: 5 calls at 20/s took {elapsed:.2f}s")
+
+    # A reservation taken into debt holds back blocking callers too
+    limiter = RateLimiter(rate_per_second=20, burst=1)
+    assert limiter.reserve(PRIORITY_WRITE) == 0
+    delay = limiter.reserve(PRIORITY_WRITE)
+    assert 0.04 <= delay <= 0.05, delay
+    started_at = time.monotonic()
+    limiter.acquire(PRIORITY_WEBHOOK)
+    assert time.monotonic() - started_at >= 0.09
+    print("reserve: async reservations and blocking acquires share the bucket")
+
+    # A 429 pauses everyone for Retry-After, capped at MAX_PAUSE_SECONDS; an
+    # exhausted quota pauses until X-RateLimit-Reset, seconds or epoch
+    def pause(status_code, headers):
+        limiter = RateLimiter(rate_per_second=20, burst=1)
+        limiter.update_from_response(status_code, headers)
+        return limiter._blocked_until - time.monotonic()
+
+    assert 0.9 < pause(429, {"Retry-After": "1"}) <= 1
+    assert MAX_PAUSE_SECONDS - 1 < pause(429, {"Retry-After": "99999"})
+    assert pause(429, {"Retry-After": "99999"}) <= MAX_PAUSE_SECONDS
+    exhausted = {"X-RateLimit-Remaining": "0"}
+    assert 29 < pause(200, {**exhausted, "X-RateLimit-Reset": "30"}) <= 30
+    epoch_reset = str(int(time.time()) + 30)
+    assert 28 < pause(200, {**exhausted, "X-RateLimit-Reset": epoch_reset}) <= 30
+    assert pause(200, {"X-RateLimit-Remaining": "5"}) <= 0
+    print("throttle: Retry-After and X-RateLimit-Reset pause the limiter")
+
+    limiter = RateLimiter(rate_per_second=20, burst=1)
+    limiter.update_from_response(429, {"Retry-After": "0.1"})
+    started_at = time.monotonic()
+    limiter.acquire(PRIORITY_WEBHOOK)
+    assert time.monotonic() - started_at >= 0.1
+    assert limiter.stats()["throttled"] == 1
+    print("throttle: even webhook calls wait out the pause")
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Run the claim, release and recheck contract of both shipment trackers,
+including concurrent webhook events for the same sales order, and check
+that a shipped order is propagated exactly once.
+
+    python checks/check_shipments.py
+"""
+
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CLAIM_SECONDS = 0.2
+RETENTION_SECONDS = 0.4
+
+
+def check_contract(name, open_tracker):
+    tracker = open_tracker()
+    assert tracker.claim("a")
+    assert not tracker.claim("a")
+    # The refused event asked for a recheck, so the holder looks again once
+    assert tracker.release("a")
+    assert not tracker.release("a")
+    assert tracker.claim("a")
+    tracker.mark_shipped("a", "SO-1", "TRACK-1")
+    assert not tracker.claim("a")
+    assert tracker.claim("b")
+    tracker.forget("b")
+    assert tracker.claim("b")
+    # forget only drops claims, a shipped order stays shipped
+    tracker.forget("a")
+    assert not tracker.claim("a")
+    assert tracker.stats() == {"claimed": 1, "shipped": 1}, tracker.stats()
+    print(f"{name}: claim, release, recheck and forget")
+
+    # A claim left behind by a crashed worker lapses, and so does a shipment
+    # once it is past retention
+    assert not tracker.claim("b")
+    time.sleep(CLAIM_SECONDS)
+    assert tracker.claim("b")
+    time.sleep(RETENTION_SECONDS - CLAIM_SECONDS)
+    tracker.purge_expired()
+    assert tracker.stats() == {"claimed": 1, "shipped": 0}, tracker.stats()
+    assert tracker.claim("a")
+    print(f"{name}: abandoned claims lapse and old shipments are purged")
+
+
+def check_concurrent_claims(name, open_tracker):
+    # Workers racing on one order: exactly one of them gets it
+    trackers = [open_tracker() for _ in range(8)]
+    barrier = threading.Barrier(len(trackers))
+    claimed = []
+
+    def claim(tracker):
+        barrier.wait()
+        if tracker.claim("race"):
+            claimed.append(tracker)
+
+    threads = [threading.Thread(target=claim, args=(t,)) for t in trackers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(claimed) == 1, len(claimed)
+    print(f"{name}: one claim out of {len(trackers)} concurrent events")
+
+
+def check_events_until_shipped(name, open_tracker):
+    # Mirrors main.process_salesorder_event against an order that ships while
+    # events keep coming in; it must be propagated once, and not missed
+    tracker = open_tracker()
+    shipped = threading.Event()
+    lookups = []
+    propagated = []
+
+    def process_event():
+        if not tracker.claim("order"):
+            return
+        while True:
+            lookups.append(1)
+            time.sleep(0.001)
+            if shipped.is_set():
+                break
+            if not tracker.release("order"):
+                return
+        propagated.append(1)
+        tracker.mark_shipped("order", "SO-2", "TRACK-2")
+
+    threads = []
+    for i in range(200):
+        if i == 150:
+            shipped.set()
+        thread = threading.Thread(target=process_event)
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.0005)
+    for thread in threads:
+        thread.join()
+    assert len(propagated) == 1, len(propagated)
+    print(f"{name}: shipped once after {len(lookups)} lookups for 200 events")
+
+
+def main():
+    state_dir = tempfile.mkdtemp(prefix="check-state-")
+    os.environ["STATE_DIR"] = state_dir
+    import logging
+
+    logging.disable(logging.INFO)
+    from shipments import MemoryShipmentTracker, ShipmentTracker
+
+    paths = itertools.count()
+
+    def sqlite_backend():
+        # Every tracker opened from one factory shares a file, like workers do
+        path = os.path.join(state_dir, f"shipments-{next(paths)}.sqlite3")
+        return lambda: ShipmentTracker(path, CLAIM_SECONDS, RETENTION_SECONDS)
+
+    def memory_backend():
+        # One process, so every caller shares the instance
+        tracker = MemoryShipmentTracker(100, CLAIM_SECONDS, RETENTION_SECONDS)
+        return lambda: tracker
+
+    for name, backend in (("sqlite", sqlite_backend), ("memory", memory_backend)):
+        check_contract(name, backend())
+        check_concurrent_claims(name, backend())
+        check_events_until_shipped(name, backend())
+
+    tracker = MemoryShipmentTracker(2, CLAIM_SECONDS, RETENTION_SECONDS)
+    for sales_order_id in "abc":
+        tracker.mark_shipped(sales_order_id, sales_order_id, "")
+    assert tracker.stats() == {"claimed": 0, "shipped": 2}, tracker.stats()
+    assert tracker.claim("a") and not tracker.claim("c")
+    print("memory: bounded by max_entries, oldest evicted first")
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,66 @@ INFLOW_COMPANY_ID = os.getenv("INFLOW_COMPANY_ID")
 INFLOW_TOKEN = os.getenv("INFLOW_TOKEN")
 INFLOW_WEBHOOK_SUBSCRIPTION_ID = os.getenv("INFLOW_WEBHOOK_SUBSCRIPTION_ID")
 SERVER_URL = os.getenv("SERVER_URL")
+# Release identifier, a new one registers the Inflow webhook again
+DEPLOYMENT_ID = os.getenv("DEPLOYMENT_ID", "")
+WEBHOOK_REGISTRATION_TTL_SECONDS = int(
+    os.getenv("WEBHOOK_REGISTRATION_TTL_SECONDS", "86400")
+)
 SLACK_APP_TOKEN = os.getenv("SLACK_APP_TOKEN")
 SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
-SLACK_CHANNEL_ID = os.getenv("SLACK_CHANNEL_ID")
\ No newline at end of file
+SLACK_CHANNEL_ID = os.getenv("SLACK_CHANNEL_ID")
+STATE_DIR = os.getenv("STATE_DIR", ".state")
+INFLOW_ORDER_PUSH_WORKERS = int(os.getenv("INFLOW_ORDER_PUSH_WORKERS", "4"))
+CATALOG_CACHE_TTL_SECONDS = int(os.getenv("CATALOG_CACHE_TTL_SECONDS", "900"))
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "16"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+# "sqlite" is shared by every worker and survives restarts, "memory" is a
+# bounded LRU for a single process
+SHIPMENT_BACKEND = os.getenv("SHIPMENT_BACKEND", "sqlite")
+SHIPMENT_MAX_ENTRIES = int(os.getenv("SHIPMENT_MAX_ENTRIES", "100000"))
+SHIPMENTS_SQLITE_PATH = os.getenv(
+    "SHIPMENTS_SQLITE_PATH", f"{STATE_DIR}/shipments.sqlite3"
+)
+SHIPMENT_CLAIM_SECONDS = int(os.getenv("SHIPMENT_CLAIM_SECONDS", "300"))
+SHIPMENT_RETENTION_SECONDS = int(
+    os.getenv("SHIPMENT_RETENTION_SECONDS", str(90 * 24 * 3600))
+)
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+HTTP_READ_TIMEOUT_SECONDS = float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "30"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+INFLOW_RATE_LIMIT_PER_MINUTE = float(os.getenv("INFLOW_RATE_LIMIT_PER_MINUTE", "120"))
+INFLOW_PAGE_WORKERS = int(os.getenv("INFLOW_PAGE_WORKERS", "4"))
+INFLOW_RATE_LIMIT_BURST = int(os.getenv("INFLOW_RATE_LIMIT_BURST", "10"))
+SALESFORCE_POLL_PAGE_SIZE = int(os.getenv("SALESFORCE_POLL_PAGE_SIZE", "200"))
+SALESFORCE_POLL_MAX_PAGES = int(os.getenv("SALESFORCE_POLL_MAX_PAGES", "10"))
+ORDERS_POLL_INTERVAL_SECONDS = int(os.getenv("ORDERS_POLL_INTERVAL_SECONDS", "60"))
+CUSTOMERS_POLL_INTERVAL_SECONDS = int(
+    os.getenv("CUSTOMERS_POLL_INTERVAL_SECONDS", "60")
+)
+PRODUCTS_POLL_INTERVAL_SECONDS = int(os.getenv("PRODUCTS_POLL_INTERVAL_SECONDS", "60"))
+SCHEDULER_THREADS = int(os.getenv("SCHEDULER_THREADS", "4"))
+# How often a process that isn't running the poll jobs checks whether the one
+# that is has gone away
+POLLER_ELECTION_SECONDS = float(os.getenv("POLLER_ELECTION_SECONDS", "10"))
+# "poll" runs the SOQL poll jobs, "cdc" subscribes to Change Data Capture events
+SALESFORCE_EVENT_MODE = os.getenv("SALESFORCE_EVENT_MODE", "poll")
+# Upsert key for Product2, set to the Inflow SKU. It must be an External ID
+# or idLookup field, which ProductCode is not, hence StockKeepingUnit.
+SALESFORCE_PRODUCT_EXTERNAL_ID_FIELD = os.getenv(
+    "SALESFORCE_PRODUCT_EXTERNAL_ID_FIELD", "StockKeepingUnit"
+)
+SLACK_COALESCE_SECONDS = float(os.getenv("SLACK_COALESCE_SECONDS", "2"))
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+OUTBOX_SQLITE_PATH = os.getenv("OUTBOX_SQLITE_PATH", f"{STATE_DIR}/outbox.sqlite3")
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+# Writes arriving together (a shipping wave, a poll's worth of orders) share calls
+OUTBOX_BATCH_WINDOW_SECONDS = float(os.getenv("OUTBOX_BATCH_WINDOW_SECONDS", "1"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "10"))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "3600"))
+# How long a drainer holds the entries it is delivering before another may
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+# Entries that fail this many times move to the outbox_dead table
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))
@@ -0,0 +1,23 @@
+import threading
+from utils import load_state, save_state
+
+CURSORS_STATE_NAME = "cursors"
+
+
+class CursorStore:
+    def __init__(self, state_name=CURSORS_STATE_NAME) -> None:
+        self.state_name = state_name
+        self._lock = threading.Lock()
+        self._cursors = load_state(state_name, {})
+
+    def get(self, stream):
+        with self._lock:
+            return self._cursors.get(stream)
+
+    def set(self, stream, cursor):
+        with self._lock:
+            self._cursors[stream] = cursor
+            save_state(self.state_name, self._cursors)
+
+
+cursor_store = CursorStore()
@@ -0,0 +1,18 @@
+wsgi_app = "main:app"
+
+
+def on_starting(server):
+    # Runs once in the master before any worker forks, so workers find the
+    # webhook registered and skip straight to serving
+    import transport
+    from inflow import Inflow
+
+    Inflow(warm_catalog=False).ensure_salesorder_webhook()
+    transport.close_sessions()
+
+
+def post_fork(server, worker):
+    # Workers open their own connections, whatever the master left behind
+    import transport
+
+    transport.close_sessions()
@@ -1,64 +1,333 @@
-import requests
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import transport
 from config import (
+    DEPLOYMENT_ID,
+    HTTP_MAX_RETRIES,
     INFLOW_BASE_URL,
     INFLOW_COMPANY_ID,
+    INFLOW_PAGE_WORKERS,
+    INFLOW_RATE_LIMIT_BURST,
+    INFLOW_RATE_LIMIT_PER_MINUTE,
     INFLOW_TOKEN,
     INFLOW_WEBHOOK_SUBSCRIPTION_ID,
     SERVER_URL,
+    WEBHOOK_REGISTRATION_TTL_SECONDS,
 )
-from datetime import datetime
-import pytz
 import logging
+from rate_limit import (
+    PRIORITY_BULK,
+    PRIORITY_WEBHOOK,
+    PRIORITY_WRITE,
+    RateLimiter,
+)
+from catalog import CUSTOMERS_CACHE_KEY, PRODUCTS_CACHE_KEY, catalog_cache
+from sku_index import SkuIndex
+from cursors import cursor_store
+from utils import load_state, parse_inflow_timestamp, save_state
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+PRODUCTS_CURSOR_STREAM = "inflow_products"
+CATALOG_SNAPSHOT_STATE = "inflow_catalog_snapshot"
+WEBHOOK_REGISTRATION_STATE = "inflow_webhook_registration"
+PAGE_SIZE = 100
+
+# Shared by every Inflow instance, since the quota is per company
+inflow_rate_limiter = RateLimiter(
+    INFLOW_RATE_LIMIT_PER_MINUTE / 60, INFLOW_RATE_LIMIT_BURST
+)
+
 
 class Inflow:
-    def __init__(self) -> None:
+    def __init__(self, warm_catalog=True) -> None:
         self.url = f"{INFLOW_BASE_URL}/{INFLOW_COMPANY_ID}"
         self.request_headers = {
             "Authorization": f"Bearer {INFLOW_TOKEN}",
             "Accept": "application/json;version=2024-03-12",
         }
         self.webhook_subscription_id = INFLOW_WEBHOOK_SUBSCRIPTION_ID
-        self.products_state = self.get_inflow_products()
+        self.rate_limiter = inflow_rate_limiter
+        self.products_watermark = cursor_store.get(PRODUCTS_CURSOR_STREAM)
+        # Watermark and finished products are only saved once the caller has
+        # queued them, see commit_product_updates
+        self.saved_products_watermark = self.products_watermark
+        self.pending_finished_products = []
+        # isFinished per SKU as of the watermark, what the delta sync compares
+        # against. Kept out of the evicting cache: a reload after expiry already
+        # holds the change and would hide the transition.
+        self.finished_flags = None
+        self._sku_index = None
+        self.catalog_ready = threading.Event()
+        self.catalog_seconds = None
+        if warm_catalog:
+            self.warm_catalog()
+
+    # Both raise rather than hand back an empty catalog, which would map every
+    # order to no lines and customer while the caller moves its cursor on
+    @property
+    def products_state(self):
+        products = catalog_cache.get(PRODUCTS_CACHE_KEY, self.load_inflow_products)
+        if products is None:
+            raise RuntimeError("Inflow products catalog could not be loaded")
+        return products
+
+    @property
+    def sku_index(self):
+        products = self.products_state
+        # Rebuilt only when the cache hands back a freshly loaded catalog
+        if self._sku_index is None or self._sku_index.products is not products:
+            self._sku_index = SkuIndex(products)
+        return self._sku_index
+
+    @property
+    def customers_state(self):
+        customers = catalog_cache.get(CUSTOMERS_CACHE_KEY, self.get_inflow_customers)
+        if customers is None:
+            raise RuntimeError("Inflow customers catalog could not be loaded")
+        return customers
+
+    def warm_catalog(self):
+        # Startup never waits on a full download: the last snapshot seeds the
+        # cache and the products poll catches up from its watermark. Without
+        # one the catalog loads in the background, and callers that need it
+        # first wait on the cache's single-flight load.
+        started_at = time.monotonic()
+        snapshot = load_state(CATALOG_SNAPSHOT_STATE)
+        if snapshot and catalog_cache.peek(PRODUCTS_CACHE_KEY) is None:
+            self.products_watermark = snapshot["watermark"]
+            self.finished_flags = snapshot.get("finished") or self.finished_flags_of(
+                snapshot["products"]
+            )
+            catalog_cache.set(PRODUCTS_CACHE_KEY, snapshot["products"])
+            logger.info(
+                f"Loaded {len(snapshot['products'])} inflow products from snapshot "
+                f"as of {self.products_watermark}"
+            )
+        if catalog_cache.peek(PRODUCTS_CACHE_KEY) is not None:
+            self.mark_catalog_ready(started_at)
+            return
+        threading.Thread(
+            target=self.load_catalog_in_background,
+            args=(started_at,),
+            name="inflow-catalog-warmup",
+            daemon=True,
+        ).start()
+
+    def load_catalog_in_background(self, started_at):
+        if catalog_cache.get(PRODUCTS_CACHE_KEY, self.load_inflow_products):
+            self.mark_catalog_ready(started_at)
+
+    def mark_catalog_ready(self, started_at):
+        self.catalog_seconds = time.monotonic() - started_at
+        self.catalog_ready.set()
+        logger.info(f"Inflow catalog ready in {self.catalog_seconds:.2f}s")
+
+    @staticmethod
+    def finished_flags_of(products_dict):
+        return {sku: p["isFinished"] for sku, p in products_dict.items()}
+
+    def save_catalog_snapshot(self, products_dict):
+        # The flags go along since a reloaded catalog can be ahead of the
+        # watermark, while the flags never are
+        save_state(
+            CATALOG_SNAPSHOT_STATE,
+            {
+                "watermark": self.products_watermark,
+                "products": products_dict,
+                "finished": self.finished_flags,
+            },
+        )
+
+    def load_inflow_products(self):
+        products_dict = self.get_inflow_products()
+        # Only the first load starts the watermark. A reload after expiry is
+        # ahead of it, so it neither seeds the sync nor replaces the snapshot.
+        if products_dict and self.products_watermark is None:
+            self.products_watermark = max(
+                (v["timestamp"] for v in products_dict.values()),
+                key=parse_inflow_timestamp,
+            )
+            self.finished_flags = self.finished_flags_of(products_dict)
+            self.save_catalog_snapshot(products_dict)
+            cursor_store.set(PRODUCTS_CURSOR_STREAM, self.products_watermark)
+            self.saved_products_watermark = self.products_watermark
+        return products_dict
+
+    def request(self, method, url, priority, **kwargs):
+        # The session leaves 429s to us, so every retry queues at the limiter
+        # again behind the pause the 429 set
+        session = transport.get_session("inflow", transport.LIMITED_RETRY_STATUSES)
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            self.rate_limiter.acquire(priority)
+            response = session.request(
+                method, url, headers=self.request_headers, **kwargs
+            )
+            self.rate_limiter.update_from_response(
+                response.status_code, response.headers
+            )
+            if (
+                response.status_code != 429
+                or method not in transport.RETRY_METHODS
+                or attempt == HTTP_MAX_RETRIES
+            ):
+                return response
+
+    @staticmethod
+    def parse_product(r):
+        return {
+            "name": r["name"],
+            "productId": r["productId"],
+            "timestamp": r["lastModifiedDateTime"],
+            "isFinished": r["customFields"]["custom2"],
+            "unitPrice": r["customFields"]["custom3"],
+            "activeRevision": r["customFields"]["custom6"],
+        }
+
+    def get_page(self, url, params):
+        response = self.request("GET", url, PRIORITY_BULK, params=params)
+        return response, response.json()
+
+    def iter_keyset_pages(self, url, id_key):
+        after = None
+        while True:
+            params = {"count": PAGE_SIZE, "after": after}
+            _, page = self.get_page(url, params)
+            if not page:
+                return
+            yield page
+            if len(page) < PAGE_SIZE:
+                return
+            after = page[-1][id_key]
+
+    def iter_pages(self, resource, id_key):
+        # The first page reports the total, so the rest are fetched by skip in
+        # parallel. They are held until the pass checks out, since a mismatch
+        # means some of them are stale and only the serial walk is kept.
+        url = f"{self.url}/{resource}"
+        params = {"count": PAGE_SIZE, "skip": 0, "sort": id_key, "includeCount": True}
+        response, first_page = self.get_page(url, params)
+        total = response.headers.get("X-listCount")
+        if total is None:
+            logger.info(f"No count for inflow {resource}, paging serially")
+            yield from self.iter_keyset_pages(url, id_key)
+            return
+        total = int(total)
+        pages = [first_page]
+        with ThreadPoolExecutor(INFLOW_PAGE_WORKERS) as executor:
+            futures = [
+                executor.submit(self.get_page, url, {**params, "skip": skip})
+                for skip in range(PAGE_SIZE, total, PAGE_SIZE)
+            ]
+            pages.extend(future.result()[1] for future in as_completed(futures))
+        # An insert or delete mid-walk shifts records across skip boundaries
+        seen = len({r[id_key] for page in pages for r in page})
+        if seen != total:
+            logger.warning(
+                f"Inflow {resource} changed while paging ({seen} of {total}), "
+                "walking them again serially"
+            )
+            yield from self.iter_keyset_pages(url, id_key)
+            return
+        yield from pages
 
     def get_inflow_products(self):
         try:
-            url = f"{self.url}/products"
             products_dict = {}
-            count = 100
-            after = None
-            session = requests.Session()
-            while True:
-                params = {
-                    "count": count,
-                    "after": after,
-                    "includeCount": True,
-                }
-                response = session.get(
-                    url, headers=self.request_headers, params=params, timeout=10
-                ).json()
-                if not response:
-                    break
-                for r in response:
-                    products_dict[r["sku"]] = {
-                        "name": r["name"],
-                        "productId": r["productId"],
-                        "timestamp": r["lastModifiedDateTime"],
-                        "isFinished": r["customFields"]["custom2"],
-                        "unitPrice": r["customFields"]["custom3"],
-                        "activeRevision": r["customFields"]["custom6"]
-                    }
-                if len(response) < count:
-                    break
-                after = response[-1]["productId"]
+            for page in self.iter_pages("products", "productId"):
+                for r in page:
+                    products_dict[r["sku"]] = self.parse_product(r)
             return products_dict
         except Exception as e:
             logger.error(f"Error getting inflow products: {e}")
 
+    def get_inflow_products_modified_since(self, watermark):
+        # Newest first, so paging can stop as soon as a page crosses the watermark
+        url = f"{self.url}/products"
+        watermark_ts = parse_inflow_timestamp(watermark) if watermark else None
+        products_dict = {}
+        count = 100
+        skip = 0
+        while True:
+            params = {
+                "count": count,
+                "skip": skip,
+                "sort": "lastModifiedDateTime",
+                "sortDesc": True,
+            }
+            response = self.request("GET", url, PRIORITY_BULK, params=params).json()
+            if not response:
+                break
+            reached_watermark = False
+            for r in response:
+                ts = parse_inflow_timestamp(r["lastModifiedDateTime"])
+                if watermark_ts is not None and ts <= watermark_ts:
+                    reached_watermark = True
+                    break
+                products_dict.setdefault(r["sku"], self.parse_product(r))
+            if reached_watermark or len(response) < count:
+                break
+            skip += count
+        return products_dict
+
+    def sync_inflow_products(self):
+        if self.products_watermark is None:
+            # Without a watermark the delta is the whole catalog, fetched
+            # serially while the first load is still using the quota for it.
+            # That load seeds the watermark, so wait on it (or retry it if the
+            # warm-up failed) and sync from the next tick.
+            logger.info("Inflow catalog not loaded yet, skipping product sync")
+            catalog_cache.get(PRODUCTS_CACHE_KEY, self.load_inflow_products)
+            return {}
+        changed_products = self.get_inflow_products_modified_since(
+            self.products_watermark
+        )
+        if not changed_products:
+            return changed_products
+        finished_flags = self.finished_flags
+        if finished_flags is None:
+            # No state as of the watermark (snapshot lost), so a transition
+            # can't be told apart from an already finished product
+            logger.warning(
+                "No inflow product state at the watermark, "
+                "skipping finished product detection for this sync"
+            )
+            cached = catalog_cache.peek(PRODUCTS_CACHE_KEY)
+            finished_flags = self.finished_flags_of(cached or {})
+        else:
+            for sku, product in changed_products.items():
+                previous_is_finished = finished_flags.get(sku, "")
+                if previous_is_finished == "" and product["isFinished"] == "Yes":
+                    body = {
+                        "name": product["name"],
+                        "listPrice": product["unitPrice"],
+                        "sku": sku,
+                    }
+                    self.pending_finished_products.append(body)
+        for sku, product in changed_products.items():
+            finished_flags[sku] = product["isFinished"]
+        self.finished_flags = finished_flags
+        self.products_watermark = max(
+            (v["timestamp"] for v in changed_products.values()),
+            key=parse_inflow_timestamp,
+        )
+        # Merge into the cached catalog without ever reloading it here. If it
+        # has expired the next reader loads a full one that holds the change.
+        products_state = catalog_cache.peek(PRODUCTS_CACHE_KEY)
+        if products_state is not None:
+            sku_index = self._sku_index
+            for sku, product in changed_products.items():
+                products_state[sku] = product
+                if sku_index is not None and sku_index.products is products_state:
+                    sku_index.update(sku, product)
+            # A delta merge keeps the cached catalog fresh, so reset its TTL
+            catalog_cache.set(PRODUCTS_CACHE_KEY, products_state)
+        logger.info(f"Synced {len(changed_products)} changed inflow products")
+        return changed_products
+
     def subscribe_to_salesorder_webhook(self):
         try:
             WEBHOOK_URL = f"{SERVER_URL}/webhook"
@@ -68,39 +337,62 @@ class Inflow:
                 "events": ["salesorder.updated"],
                 "webHookSubscriptionId": self.webhook_subscription_id,
             }
-            response = requests.put(
+            response = self.request(
+                "PUT",
                 WEBHOOK_URL_INFLOW,
-                headers=self.request_headers,
+                PRIORITY_WRITE,
                 data=json.dumps(webhook_data),
             )
             if response.status_code == 200:
                 logger.info("Successfully subscribed to salesorder.updated webhook.")
                 logger.info(f"Response: {response.json()}")
+                return True
             else:
                 logger.error("Failed to subscribe to webhook.")
                 logger.error(f"Status Code: {response.status_code}")
                 logger.error(f"Error: {response.json()}")
+                return False
         except Exception as e:
             logger.error(f"Error subscribing to webhook: {e}")
+            return False
+
+    def ensure_salesorder_webhook(self):
+        # Once per deployment: workers and restarts of the same DEPLOYMENT_ID
+        # that find this URL already registered skip the PUT. The marker also
+        # lapses after WEBHOOK_REGISTRATION_TTL_SECONDS, in case the webhook
+        # was changed or removed in Inflow meanwhile.
+        registration = {
+            "url": f"{SERVER_URL}/webhook",
+            "webHookSubscriptionId": self.webhook_subscription_id,
+            "deploymentId": DEPLOYMENT_ID,
+        }
+        saved = load_state(WEBHOOK_REGISTRATION_STATE) or {}
+        registered_at = saved.pop("registeredAt", 0)
+        age_seconds = time.time() - registered_at
+        if saved == registration and age_seconds < WEBHOOK_REGISTRATION_TTL_SECONDS:
+            logger.info("salesorder.updated webhook already registered")
+            return True
+        if self.subscribe_to_salesorder_webhook():
+            save_state(
+                WEBHOOK_REGISTRATION_STATE,
+                {**registration, "registeredAt": time.time()},
+            )
+            return True
+        return False
 
     def get_inflow_order(self, salesOrderId):
-        try:
-            url = f"{self.url}/sales-orders/{salesOrderId}?include=shipLines"
-            payload = {}
-            response = requests.request(
-                "GET", url, headers=self.request_headers, data=payload
-            ).json()
-            return response
-        except Exception as e:
-            logger.error(f"Error getting inflow order: {e}")
+        # Raises rather than returning None, so the webhook event is retried
+        url = f"{self.url}/sales-orders/{salesOrderId}?include=shipLines"
+        response = self.request("GET", url, PRIORITY_WEBHOOK)
+        if response.status_code != 200:
+            raise Exception(f"{response.status_code} {response.text}")
+        return response.json()
 
     def create_inflow_order(self, body):
         try:
             url = f"{self.url}/sales-orders"
             payload = json.dumps(body)
-            response = requests.request(
-                "PUT", url, headers=self.request_headers, data=payload
-            )
+            response = self.request("PUT", url, PRIORITY_WRITE, data=payload)
             order_number = body["orderNumber"]
             if response.status_code == 200:
                 logger.info(f"Inflow order successfully created: {order_number}")
@@ -111,74 +403,62 @@ class Inflow:
                 return False, order_number, response.content
         except Exception as e:
             logger.error(f"Error creating inflow order: {e}")
+            return False, body.get("orderNumber"), e
 
     def create_inflow_customer(self, body):
         try:
             url = f"{self.url}/customers"
             payload = json.dumps(body)
-            response = requests.request(
-                "PUT", url, headers=self.request_headers, data=payload
-            )
+            response = self.request("PUT", url, PRIORITY_WRITE, data=payload)
             name = body["name"]
             if response.status_code == 200:
                 logger.info(f"Inflow customer successfully created: {name}")
+                customers = catalog_cache.peek(CUSTOMERS_CACHE_KEY)
+                if customers is not None:
+                    customers[name] = body["customerId"]
                 return True, name, response.content
             else:
                 logger.error(f"Inflow customer was not created: {response.status_code}")
                 logger.error(f"Inflow customer was not created: {response.content}")
+                if response.status_code == 409:
+                    # The customer exists in Inflow but not in the cached
+                    # names, reload them on the next lookup
+                    catalog_cache.invalidate(CUSTOMERS_CACHE_KEY)
                 return False, name, response.content
         except Exception as e:
             logger.error(f"Error creating inflow customer: {e}")
+            return False, body.get("name"), e
 
     def get_inflow_customers(self):
         try:
-            url = f"{self.url}/customers"
             customers_dict = {}
-            count = 100
-            after = None
-            session = requests.Session()
-            while True:
-                params = {
-                    "count": count,
-                    "after": after,
-                    "includeCount": True,
-                }
-                response = session.get(
-                    url, headers=self.request_headers, params=params, timeout=10
-                ).json()
-                if not response:
-                    break
-                for r in response:
+            for page in self.iter_pages("customers", "customerId"):
+                for r in page:
                     customers_dict[r["name"]] = r["customerId"]
-                if len(response) < count:
-                    break
-                after = response[-1]["customerId"]
             return customers_dict
         except Exception as e:
             logger.error(f"Error in getting inflow customers: {e}")
 
-    def get_inflow_latest_product_update(self):
+    def get_inflow_latest_product_updates(self):
         try:
-            products_dict = self.get_inflow_products()
-            now = datetime.now(pytz.utc)
-            body = {}
-            for k, v in products_dict.items():
-                ts = v["timestamp"]
-                if len(ts) == 31:
-                    trimmed_iso_str = ts[:25] + "0" + ts[-6:]
-                else:
-                    trimmed_iso_str = ts[:26] + ts[-6:]
-                ts = datetime.fromisoformat(trimmed_iso_str)
-                time_difference = now - ts
-                if (
-                    self.products_state[k]["isFinished"] == ""
-                    and v["isFinished"] == "Yes"
-                    and time_difference.total_seconds() <= 30
-                ):
-                    body = {"name": v["name"], "listPrice": v["unitPrice"], "sku": k}
-                    self.products_state[k]["isFinished"] = "Yes"
-                    return body, True
+            self.sync_inflow_products()
+            if self.pending_finished_products:
+                return list(self.pending_finished_products), True
             logger.info("No latest creation of finished products")
-            return body, False
+            return [], False
         except Exception as e:
             logger.error(f"Error in getting latest inflow product update: {e}")
+            return [], False
+
+    def commit_product_updates(self, bodies):
+        # Called once bodies are queued. Until then they stay pending and the
+        # saved watermark stays put, so a failed enqueue or a crash loses none.
+        del self.pending_finished_products[: len(bodies)]
+        if self.products_watermark == self.saved_products_watermark:
+            return
+        products_state = catalog_cache.peek(PRODUCTS_CACHE_KEY)
+        if products_state is not None:
+            # Snapshot first, a restart in between replays the delta against it
+            self.save_catalog_snapshot(products_state)
+        cursor_store.set(PRODUCTS_CURSOR_STREAM, self.products_watermark)
+        self.saved_products_watermark = self.products_watermark
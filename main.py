@@ -1,69 +1,283 @@
+import time
+
+started_at = time.monotonic()
+
 import threading
-from config import SLACK_APP_TOKEN, SLACK_BOT_TOKEN
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    CUSTOMERS_POLL_INTERVAL_SECONDS,
+    INFLOW_ORDER_PUSH_WORKERS,
+    OUTBOX_BACKOFF_SECONDS,
+    OUTBOX_BATCH_WINDOW_SECONDS,
+    OUTBOX_LEASE_SECONDS,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_MAX_BACKOFF_SECONDS,
+    OUTBOX_POLL_SECONDS,
+    OUTBOX_SQLITE_PATH,
+    ORDERS_POLL_INTERVAL_SECONDS,
+    POLLER_ELECTION_SECONDS,
+    PRODUCTS_POLL_INTERVAL_SECONDS,
+    SALESFORCE_EVENT_MODE,
+    SCHEDULER_THREADS,
+    SLACK_APP_TOKEN,
+    SLACK_BOT_TOKEN,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_WORKERS,
+)
 from inflow import Inflow
-from salesforce import SalesForce
+from cursors import cursor_store
+from salesforce import (
+    ACCOUNTS_CURSOR_STREAM,
+    ORDERS_CURSOR_STREAM,
+    SOBJECT_COLLECTION_SIZE,
+    SalesForce,
+)
 import json
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from apscheduler.executors.pool import (
+    ThreadPoolExecutor as SchedulerThreadPoolExecutor,
+)
 from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime
-import pytz
 import logging
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack import Slack
+from outbox import Outbox
+from shipments import create_shipment_tracker, is_shipped, shipment_update
+from webhook_queue import WebhookQueue
+from utils import try_lock_state
+from streaming import ChangeEventConsumer, CometDEventSource
+from metrics import (
+    instrument_app,
+    render_prometheus,
+    gauge,
+    snapshot as metrics_snapshot,
+    timed,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-sf = SalesForce()
+instrument_app(app)
 inflow = Inflow()
-inflow.subscribe_to_salesorder_webhook()
-slack_app = App(token=SLACK_BOT_TOKEN)
+sf = SalesForce(inflow)
+# Usually already done by gunicorn's on_starting or an earlier run, and
+# otherwise nothing at startup needs to wait for it
+threading.Thread(
+    target=inflow.ensure_salesorder_webhook,
+    name="inflow-webhook-registration",
+    daemon=True,
+).start()
 slack = Slack()
+order_push_executor = ThreadPoolExecutor(max_workers=INFLOW_ORDER_PUSH_WORKERS)
+
+
+def report(send_success_message, send_error_message):
+    def on_result(is_successful, name, message, attempts):
+        if is_successful:
+            send_success_message(name)
+        elif attempts == 0:
+            # The outbox keeps retrying, only the first failure is announced
+            send_error_message(name, message)
+        elif attempts + 1 == OUTBOX_MAX_ATTEMPTS:
+            send_error_message(
+                name, f"Gave up after {OUTBOX_MAX_ATTEMPTS} attempts: {message}"
+            )
+
+    return on_result
+
+
+def deliver_inflow_orders(bodies):
+    return list(order_push_executor.map(inflow.create_inflow_order, bodies))
+
+
+def deliver_inflow_customers(bodies):
+    return [inflow.create_inflow_customer(body) for body in bodies]
+
+
+def deliver_salesforce_order_updates(updates):
+    return sf.update_order_statuses(updates)
+
+
+outbox = Outbox(
+    OUTBOX_SQLITE_PATH,
+    poll_seconds=OUTBOX_POLL_SECONDS,
+    batch_window_seconds=OUTBOX_BATCH_WINDOW_SECONDS,
+    backoff_seconds=OUTBOX_BACKOFF_SECONDS,
+    max_backoff_seconds=OUTBOX_MAX_BACKOFF_SECONDS,
+    lease_seconds=OUTBOX_LEASE_SECONDS,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+)
+outbox.register(
+    "inflow_order",
+    deliver_inflow_orders,
+    batch_size=INFLOW_ORDER_PUSH_WORKERS * 10,
+    on_result=report(
+        slack.send_inflow_order_created_message,
+        slack.send_inflow_order_created_error_message,
+    ),
+)
+outbox.register(
+    "inflow_customer",
+    deliver_inflow_customers,
+    batch_size=50,
+    on_result=report(
+        slack.send_inflow_customer_created_message,
+        slack.send_inflow_customer_created_error_message,
+    ),
+)
+outbox.register(
+    "salesforce_product",
+    sf.create_products,
+    batch_size=SOBJECT_COLLECTION_SIZE,
+    on_result=report(
+        slack.send_salesforce_product_created_message,
+        slack.send_salesforce_product_created_error_message,
+    ),
+)
+outbox.register(
+    "salesforce_order_status",
+    deliver_salesforce_order_updates,
+    batch_size=SOBJECT_COLLECTION_SIZE,
+    on_result=report(
+        slack.send_salesforce_order_updated_message,
+        slack.send_salesforce_order_updated_error_message,
+    ),
+)
+
+
+# Cursors move only after the outbox has committed what they cover, so a
+# failed enqueue or a crash in between polls the same records again
 
 
 def poll_salesforce_for_updated_orders():
-    body, is_change_in_order_status = sf.get_latest_order_status_update()
+    bodies, is_change_in_order_status, cursor = sf.get_latest_order_status_updates()
     if is_change_in_order_status == True:
-        is_successful, order_number, message = inflow.create_inflow_order(body)
-        if is_successful:
-            slack.send_inflow_order_created_message(order_number)
-        else:
-            slack.send_inflow_order_created_error_message(order_number, message)
+        push_inflow_orders(bodies)
+    if cursor is not None:
+        cursor_store.set(ORDERS_CURSOR_STREAM, cursor)
+
+
+def push_inflow_orders(bodies):
+    outbox.add_many("inflow_order", bodies)
+
+
+def push_inflow_customers(bodies):
+    outbox.add_many("inflow_customer", bodies)
 
 
 def poll_salesforce_for_customer_creation():
-    body, is_new_customer_created = sf.get_latest_customer()
+    bodies, is_new_customer_created, cursor = sf.get_latest_customers()
     if is_new_customer_created == True:
-        is_successful, name, message = inflow.create_inflow_customer(body)
-        if is_successful:
-            slack.send_inflow_customer_created_message(name)
-        else:
-            slack.send_inflow_customer_created_error_message(name, message)
+        push_inflow_customers(bodies)
+    if cursor is not None:
+        cursor_store.set(ACCOUNTS_CURSOR_STREAM, cursor)
 
 
 def poll_inflow_for_product_update():
-    body, is_update_in_product = inflow.get_inflow_latest_product_update()
+    bodies, is_update_in_product = inflow.get_inflow_latest_product_updates()
     if is_update_in_product == True:
-        is_successful, name, message = sf.create_product(body)
-        if is_successful:
-            slack.send_salesforce_product_created_message(name)
-        else:
-            slack.send_salesforce_product_created_error_message(name, message)
+        outbox.add_many("salesforce_product", bodies)
+    inflow.commit_product_updates(bodies)
+
+
+POLL_JOBS = [(poll_inflow_for_product_update, PRODUCTS_POLL_INTERVAL_SECONDS)]
+if SALESFORCE_EVENT_MODE != "cdc":
+    POLL_JOBS += [
+        (poll_salesforce_for_updated_orders, ORDERS_POLL_INTERVAL_SECONDS),
+        (poll_salesforce_for_customer_creation, CUSTOMERS_POLL_INTERVAL_SECONDS),
+    ]
+
+# Each stream runs on its own schedule, a slow tick is skipped rather than
+# stacked, and a slow stream can't hold up the others
+scheduler = BackgroundScheduler(
+    executors={"default": SchedulerThreadPoolExecutor(SCHEDULER_THREADS)},
+    job_defaults={"coalesce": True, "max_instances": 1},
+)
+for job, interval_seconds in POLL_JOBS:
+    scheduler.add_job(
+        timed("job", job=job.__name__)(job),
+        "interval",
+        seconds=interval_seconds,
+        id=job.__name__,
+    )
+pollers_lock = None
+
 
+def start_pollers_when_elected():
+    # Every gunicorn worker would otherwise poll the same cursors and push the
+    # same orders, so only the process holding the pollers lock runs the poll
+    # jobs and the change event consumer. The lock passes on when it exits.
+    global pollers_lock
+    while pollers_lock is None:
+        pollers_lock = try_lock_state("pollers")
+        if pollers_lock is None:
+            time.sleep(POLLER_ELECTION_SECONDS)
+    logger.info("Running the poll jobs in this process")
+    if SALESFORCE_EVENT_MODE == "cdc":
+        ChangeEventConsumer(
+            sf, CometDEventSource(sf), push_inflow_orders, push_inflow_customers
+        ).start()
+    scheduler.start()
 
-def poll():
-    poll_salesforce_for_updated_orders()
-    poll_salesforce_for_customer_creation()
-    poll_inflow_for_product_update()
 
+threading.Thread(
+    target=start_pollers_when_elected, name="poller-election", daemon=True
+).start()
+
+shipment_tracker = create_shipment_tracker()
+
+
+def process_salesorder_event(data):
+    salesOrderId = data["salesOrderId"]
+    # Orders already propagated, or being looked at by another worker, are
+    # dropped here without a call to Inflow
+    if not shipment_tracker.claim(salesOrderId):
+        return
+    try:
+        while True:
+            response = inflow.get_inflow_order(salesOrderId)
+            if is_shipped(response):
+                break
+            if not shipment_tracker.release(salesOrderId):
+                return
+        update = shipment_update(response)
+    except Exception:
+        shipment_tracker.forget(salesOrderId)
+        raise
+    outbox.add("salesforce_order_status", update)
+    _, tracking_numbers, order_number = update
+    # The outbox delivers it from here, so the order counts as propagated
+    shipment_tracker.mark_shipped(salesOrderId, order_number, tracking_numbers)
+
+
+def retry_salesorder_events(events):
+    results = []
+    for data in events:
+        try:
+            process_salesorder_event(data)
+            results.append((True, data["salesOrderId"], "success"))
+        except Exception as e:
+            logger.error(f"Retry of sales order event {data} failed: {e}")
+            results.append((False, data["salesOrderId"], e))
+    return results
+
+
+# Events are acknowledged before they are processed, so a failed one goes to
+# the outbox and is retried from there with backoff
+outbox.register("salesorder_event", retry_salesorder_events, batch_size=10)
+outbox.start()
+
+webhook_queue = WebhookQueue(
+    timed("webhook_event")(process_salesorder_event),
+    maxsize=WEBHOOK_QUEUE_SIZE,
+    workers=WEBHOOK_WORKERS,
+    on_failure=lambda data: outbox.add("salesorder_event", data),
+)
+webhook_queue.start()
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(poll, "interval", minutes=1)
-scheduler.start()
 
-salesforce_orders_to_update_set = set()
 @app.route("/webhook", methods=["POST"])
 def webhook():
     raw_data = request.data.decode("utf-8")
@@ -73,41 +287,67 @@ def webhook():
     except json.JSONDecodeError:
         logger.error(f"Invalid JSON received: {raw_data}")
         return jsonify({"error": "Invalid JSON format"}), 400
-    salesOrderId = data["salesOrderId"]
-    response = inflow.get_inflow_order(salesOrderId)
-    est = pytz.timezone("US/Eastern")
-    now = datetime.now(est)
-    shippedDate = response["shippedDate"]
-    if shippedDate != None:
-        shippedDate = datetime.fromisoformat(f"{shippedDate}")
-        time_difference = now - shippedDate
-        if response["isCompleted"] == True and time_difference.total_seconds() <= 30:
-            tracking_numbers = ""
-            if len(response["shipLines"]) == 1:
-                tracking_numbers = response["shipLines"][0]["trackingNumber"]
-            else:
-                for shipline in response["shipLines"]:
-                    tracking_numbers = (
-                        tracking_numbers + shipline["trackingNumber"] + ","
-                    )
-                tracking_numbers = tracking_numbers[:-1]
-            order_id = response["customFields"]["custom1"]
-            order_number = response["orderNumber"]
-            if order_number in salesforce_orders_to_update_set:
-                return {"status": 200}
-            else:
-                salesforce_orders_to_update_set.add(order_number)
-            is_successful, message = sf.update_order_status(
-                order_id, tracking_numbers, order_number
-            )
-            if is_successful:
-                slack.send_salesforce_order_updated_message(order_number)
-            else:
-                slack.send_salesforce_order_updated_error_message(order_number, message)
+    if not isinstance(data, dict) or not data.get("salesOrderId"):
+        logger.error(f"Webhook payload missing salesOrderId: {raw_data}")
+        return jsonify({"error": "Missing salesOrderId"}), 400
+    if not webhook_queue.submit(data):
+        # Inflow retries non-2xx deliveries, so shed load instead of blocking
+        return jsonify({"error": "Webhook queue full"}), 503, {"Retry-After": "5"}
     return {"status": 200}
 
 
+@app.route("/webhook/stats", methods=["GET"])
+def webhook_stats():
+    return jsonify(webhook_queue.stats())
+
+
+@app.route("/outbox/stats", methods=["GET"])
+def outbox_stats():
+    return jsonify(outbox.stats())
+
+
+@app.route("/shipments/stats", methods=["GET"])
+def shipments_stats():
+    return jsonify(shipment_tracker.stats())
+
+
+@app.route("/jobs/stats", methods=["GET"])
+def jobs_stats():
+    return jsonify(metrics_snapshot())
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/inflow/rate_limit/stats", methods=["GET"])
+def inflow_rate_limit_stats():
+    return jsonify(inflow.rate_limiter.stats())
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    return jsonify(
+        {
+            "ready_seconds": ready_seconds,
+            "catalog_ready": inflow.catalog_ready.is_set(),
+            "catalog_seconds": inflow.catalog_seconds,
+        }
+    )
+
+
+ready_seconds = time.monotonic() - started_at
+gauge("startup_ready_seconds").set(ready_seconds)
+logger.info(
+    f"Ready to accept webhooks {ready_seconds:.2f}s after start, inflow catalog "
+    f"{'ready' if inflow.catalog_ready.is_set() else 'loading in background'}"
+)
+
+
 def start_slack():
+    # App() checks its token with Slack, so only the Socket Mode process pays
+    slack_app = App(token=SLACK_BOT_TOKEN)
     SocketModeHandler(slack_app, SLACK_APP_TOKEN).start()
 
 
@@ -0,0 +1,181 @@
+import functools
+import threading
+import time
+from config import METRICS_ENABLED
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            else:
+                self._counts[-1] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        with self._lock:
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(self.buckets, self._counts):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            buckets["+Inf"] = self._count
+            return {"buckets": buckets, "sum": self._sum, "count": self._count}
+
+
+class Counter:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def snapshot(self):
+        return {"value": self._value}
+
+
+class Gauge:
+    def __init__(self) -> None:
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def snapshot(self):
+        return {"value": self._value}
+
+
+_metrics = {}
+_lock = threading.Lock()
+
+
+def _get(cls, name, labels):
+    key = (name, tuple(sorted(labels.items())))
+    metric = _metrics.get(key)
+    if metric is None:
+        with _lock:
+            metric = _metrics.setdefault(key, cls())
+    return metric
+
+
+def histogram(name, **labels):
+    return _get(Histogram, name, labels)
+
+
+def counter(name, **labels):
+    return _get(Counter, name, labels)
+
+
+def gauge(name, **labels):
+    return _get(Gauge, name, labels)
+
+
+def timed(name, **labels):
+    # Records {name}_duration_seconds and {name}_errors_total; when metrics
+    # are off the function is returned untouched
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                counter(f"{name}_errors_total", **labels).inc()
+                raise
+            finally:
+                histogram(f"{name}_duration_seconds", **labels).observe(
+                    time.perf_counter() - started_at
+                )
+
+        return wrapper
+
+    return decorator
+
+
+def instrument_app(app):
+    if not METRICS_ENABLED:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started_at = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started_at = g.pop("metrics_started_at", None)
+        if started_at is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        labels = {"route": route, "method": request.method}
+        histogram("http_server_request_duration_seconds", **labels).observe(
+            time.perf_counter() - started_at
+        )
+        counter(
+            "http_server_requests_total", status=str(response.status_code), **labels
+        ).inc()
+        counter("http_server_request_bytes_total", **labels).inc(
+            request.content_length or 0
+        )
+        return response
+
+
+def snapshot():
+    with _lock:
+        items = list(_metrics.items())
+    return [
+        {"name": name, "labels": dict(labels), **metric.snapshot()}
+        for (name, labels), metric in items
+    ]
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def render_prometheus():
+    with _lock:
+        items = sorted(_metrics.items(), key=lambda item: item[0])
+    lines = []
+    typed = set()
+    for (name, labels), metric in items:
+        kind = {Histogram: "histogram", Counter: "counter", Gauge: "gauge"}[
+            type(metric)
+        ]
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+        data = metric.snapshot()
+        if kind != "histogram":
+            lines.append(f"{name}{format_labels(labels)} {data['value']}")
+            continue
+        for bound, count in data["buckets"].items():
+            lines.append(f"{name}_bucket{format_labels(labels, le=bound)} {count}")
+        lines.append(f"{name}_sum{format_labels(labels)} {data['sum']}")
+        lines.append(f"{name}_count{format_labels(labels)} {data['count']}")
+    return "\n".join(lines) + "\n"
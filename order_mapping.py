@@ -0,0 +1,126 @@
+import uuid
+from records import aggregate_order_lines
+from utils import empty_if_none
+
+HAND_CARRY = "Hand Carry"
+
+
+class MappingContext:
+    __slots__ = ("customers", "products", "sku_index", "order_date")
+
+    def __init__(self, customers, products, sku_index, now) -> None:
+        self.customers = customers
+        self.products = products
+        self.sku_index = sku_index
+        self.order_date = now.strftime("%Y-%m-%d")
+
+
+def field(path):
+    # "Account.Name" walks the relationship, a missing parent reads as ""
+    keys = tuple(path.split("."))
+
+    def get(order, ctx):
+        value = order
+        for key in keys:
+            if value is None:
+                return ""
+            value = value.get(key)
+        return empty_if_none(value)
+
+    return get
+
+
+def shipping(key, hand_carry=""):
+    def get(order, ctx):
+        address = order["ShippingAddress"]
+        if address is None:
+            return hand_carry
+        return empty_if_none(address[key])
+
+    return get
+
+
+def new_uuid(order, ctx):
+    return f"{uuid.uuid4()}"
+
+
+account_name = field("Account.Name")
+
+
+def customer_id(order, ctx):
+    return ctx.customers.get(account_name(order, ctx), "")
+
+
+def order_remarks(order, ctx):
+    return HAND_CARRY if order["ShippingAddress"] is None else ""
+
+
+def order_number(order, ctx):
+    return f"SO-{order['OrderNumber']}"
+
+
+def order_date(order, ctx):
+    return ctx.order_date
+
+
+def lines(order, ctx):
+    order_lines = aggregate_order_lines(order["OrderItems"]).get(order["Id"], {})
+    lines_array = []
+    for product_code, line in order_lines.items():
+        for sku in ctx.sku_index.match(product_code):
+            lines_array.append(
+                {
+                    "productId": ctx.products[sku]["productId"],
+                    "salesOrderLineId": f"{uuid.uuid4()}",
+                    "quantity": {"uomQuantity": str(line.quantity)},
+                    "unitPrice": str(line.listPrice),
+                }
+            )
+    return lines_array
+
+
+# Inflow sales-order body, leaves are constants or fn(order, ctx)
+ORDER_MAPPING = {
+    "salesOrderId": new_uuid,
+    "contactName": field("ShipToContact.Name"),
+    "customer": {
+        "customerId": customer_id,
+        "website": field("Account.Website"),
+    },
+    "customerId": customer_id,
+    "customFields": {"custom1": field("Id")},
+    "email": field("ShipToContact.Email"),
+    "inventoryStatus": "Started",
+    "invoicedDate": None,
+    "isCompleted": False,
+    "lines": lines,
+    "orderDate": order_date,
+    "orderNumber": order_number,
+    "orderRemarks": order_remarks,
+    "phone": field("ShipToContact.Phone"),
+    "requestedShipDate": None,
+    "shippedDate": None,
+    "shippingAddress": {
+        "address1": shipping("street", hand_carry=HAND_CARRY),
+        "city": shipping("city"),
+        "state": shipping("state"),
+        "country": shipping("country"),
+        "postalCode": shipping("postalCode"),
+        "remarks": "",
+    },
+    "shipRemarks": "",
+    "shipToCompanyName": account_name,
+    "source": "salesforce",
+}
+
+
+def compile_mapping(spec):
+    if isinstance(spec, dict):
+        items = tuple((key, compile_mapping(value)) for key, value in spec.items())
+        return lambda order, ctx: {key: build(order, ctx) for key, build in items}
+    if callable(spec):
+        return spec
+    return lambda order, ctx: spec
+
+
+transform_order = compile_mapping(ORDER_MAPPING)
@@ -0,0 +1,235 @@
+import json
+import random
+import threading
+import time
+from metrics import gauge
+from sqlite_store import SqliteStore
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Durable queue for every write to Inflow and Salesforce. Entries stay on disk
+# until their target accepts them, with exponential backoff between attempts,
+# and move to outbox_dead once they have failed max_attempts times.
+class Outbox(SqliteStore):
+    def __init__(
+        self,
+        path,
+        poll_seconds,
+        batch_window_seconds,
+        backoff_seconds,
+        max_backoff_seconds,
+        lease_seconds,
+        max_attempts,
+    ) -> None:
+        super().__init__(path)
+        self.poll_seconds = poll_seconds
+        self.batch_window_seconds = batch_window_seconds
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.handlers = {}
+        self.wakeup = threading.Event()
+        connection = self._connection()
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                last_error TEXT
+            )
+            """
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_due ON outbox (kind, next_attempt_at)"
+        )
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox_dead (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                dead_at REAL NOT NULL,
+                last_error TEXT
+            )
+            """
+        )
+
+    def register(self, kind, handler, batch_size=1, on_result=None):
+        # handler(payloads) returns one (is_successful, name, message) per
+        # payload; on_result(is_successful, name, message, attempts) sees each
+        self.handlers[kind] = (handler, batch_size, on_result)
+
+    def add(self, kind, payload):
+        self.add_many(kind, [payload])
+
+    def add_many(self, kind, payloads):
+        if kind not in self.handlers:
+            raise ValueError(f"No outbox handler for {kind}")
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                """
+                INSERT INTO outbox (kind, payload, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                [(kind, json.dumps(payload), now, now) for payload in payloads],
+            )
+        self.wakeup.set()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="outbox-drainer", daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        while True:
+            if self.wakeup.wait(self.poll_seconds):
+                # Let the rest of a burst land so it goes out in fewer calls
+                time.sleep(self.batch_window_seconds)
+            self.wakeup.clear()
+            try:
+                self.drain()
+            except Exception as e:
+                logger.exception(f"Error draining outbox: {e}")
+
+    def drain(self):
+        for kind, (handler, batch_size, on_result) in self.handlers.items():
+            while True:
+                rows = self.claim(kind, batch_size)
+                if rows:
+                    self.deliver(kind, handler, on_result, rows)
+                if len(rows) < batch_size:
+                    break
+        self.record_stats()
+
+    def claim(self, kind, batch_size):
+        # Due entries are leased before delivery by pushing their next attempt
+        # out, so drainers in other workers skip them. A lease left behind by
+        # a crash lapses after lease_seconds and the entries go out again.
+        now = time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute(
+                """
+                SELECT id, payload, attempts FROM outbox
+                WHERE kind = ? AND next_attempt_at <= ?
+                ORDER BY id LIMIT ?
+                """,
+                (kind, now, batch_size),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                [(now + self.lease_seconds, entry_id) for entry_id, _, _ in rows],
+            )
+        return rows
+
+    def deliver(self, kind, handler, on_result, rows):
+        payloads = [json.loads(payload) for _, payload, _ in rows]
+        try:
+            results = handler(payloads)
+            if len(results) != len(rows):
+                raise RuntimeError(f"{len(results)} results for {len(rows)} entries")
+        except Exception as e:
+            logger.exception(f"Error delivering {len(rows)} {kind} outbox entries: {e}")
+            results = [(False, None, e)] * len(rows)
+        delivered = []
+        dead = []
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            for (entry_id, _, attempts), (is_successful, name, message) in zip(
+                rows, results
+            ):
+                if is_successful:
+                    delivered.append((entry_id,))
+                    continue
+                if attempts + 1 >= self.max_attempts:
+                    dead.append((time.time(), str(message), entry_id))
+                    logger.error(
+                        f"Giving up on {kind} outbox entry {name or entry_id} "
+                        f"after {attempts + 1} attempts: {message}"
+                    )
+                    continue
+                delay = min(
+                    self.backoff_seconds * 2**attempts, self.max_backoff_seconds
+                ) * random.uniform(0.5, 1)
+                connection.execute(
+                    """
+                    UPDATE outbox
+                    SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+                    WHERE id = ?
+                    """,
+                    (time.time() + delay, str(message), entry_id),
+                )
+            connection.executemany(
+                """
+                INSERT INTO outbox_dead
+                    (id, kind, payload, attempts, created_at, dead_at, last_error)
+                SELECT id, kind, payload, attempts + 1, created_at, ?, ?
+                FROM outbox WHERE id = ?
+                """,
+                dead,
+            )
+            connection.executemany(
+                "DELETE FROM outbox WHERE id = ?",
+                delivered + [(entry_id,) for _, _, entry_id in dead],
+            )
+        if on_result is not None:
+            for (_, _, attempts), result in zip(rows, results):
+                on_result(*result, attempts)
+
+    def stats(self):
+        now = time.time()
+        rows = self._connection().execute(
+            """
+            SELECT kind, COUNT(*), MIN(created_at), SUM(attempts > 0)
+            FROM outbox GROUP BY kind
+            """
+        )
+        stats = {}
+        for kind in self.handlers:
+            stats[kind] = {
+                "depth": 0,
+                "oldest_age_seconds": 0.0,
+                "retrying": 0,
+                "dead": 0,
+            }
+        for kind, depth, oldest_created_at, retrying in rows:
+            stats[kind] = {
+                "depth": depth,
+                "oldest_age_seconds": now - oldest_created_at,
+                "retrying": retrying,
+                "dead": 0,
+            }
+        # Given up on, kept for inspection and replay by hand
+        dead_rows = self._connection().execute(
+            "SELECT kind, COUNT(*) FROM outbox_dead GROUP BY kind"
+        )
+        for kind, dead in dead_rows:
+            if kind in stats:
+                stats[kind]["dead"] = dead
+        return stats
+
+    def depth(self):
+        return sum(kind_stats["depth"] for kind_stats in self.stats().values())
+
+    def record_stats(self):
+        for kind, kind_stats in self.stats().items():
+            gauge("outbox_depth", kind=kind).set(kind_stats["depth"])
+            gauge("outbox_oldest_age_seconds", kind=kind).set(
+                kind_stats["oldest_age_seconds"]
+            )
+            gauge("outbox_dead", kind=kind).set(kind_stats["dead"])
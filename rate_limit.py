@@ -0,0 +1,138 @@
+import heapq
+import itertools
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Lower value is served first
+PRIORITY_WEBHOOK = 0
+PRIORITY_WRITE = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {
+    PRIORITY_WEBHOOK: "webhook",
+    PRIORITY_WRITE: "write",
+    PRIORITY_BULK: "bulk",
+}
+# Longest pause any response can impose, whatever its headers say
+MAX_PAUSE_SECONDS = 300
+
+
+def _header_number(headers, name):
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    def __init__(self, rate_per_second, burst) -> None:
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._condition = threading.Condition()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self.acquired = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.total_wait_seconds = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.max_wait_seconds = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.throttled = 0
+
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate_per_second)
+        self._updated_at = now
+
+    def acquire(self, priority=PRIORITY_BULK):
+        started_at = time.monotonic()
+        with self._condition:
+            waiter = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, waiter)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if (
+                        self._waiters[0] == waiter
+                        and now >= self._blocked_until
+                        and self._tokens >= 1
+                    ):
+                        self._tokens -= 1
+                        break
+                    if now < self._blocked_until:
+                        timeout = self._blocked_until - now
+                    else:
+                        timeout = max(1 - self._tokens, 0) / self.rate_per_second
+                    self._condition.wait(timeout=max(timeout, 0.001))
+            finally:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+            name = PRIORITY_NAMES[priority]
+            wait_seconds = time.monotonic() - started_at
+            self.acquired[name] += 1
+            self.total_wait_seconds[name] += wait_seconds
+            self.max_wait_seconds[name] = max(self.max_wait_seconds[name], wait_seconds)
+
+    def reserve(self, priority=PRIORITY_BULK):
+        # Non-blocking acquire for callers on an event loop: the token is taken
+        # now, possibly into debt, and the caller sleeps for the returned delay
+        # before sending. Blocking acquirers see the debt and wait it out too.
+        with self._condition:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            delay = max(
+                self._blocked_until - now, -self._tokens / self.rate_per_second, 0.0
+            )
+            name = PRIORITY_NAMES[priority]
+            self.acquired[name] += 1
+            self.total_wait_seconds[name] += delay
+            self.max_wait_seconds[name] = max(self.max_wait_seconds[name], delay)
+            return delay
+
+    def update_from_response(self, status_code, headers):
+        delay = None
+        retry_after = _header_number(headers, "Retry-After")
+        remaining = _header_number(headers, "X-RateLimit-Remaining")
+        reset = _header_number(headers, "X-RateLimit-Reset")
+        if status_code == 429:
+            delay = retry_after if retry_after is not None else 1 / self.rate_per_second
+        elif remaining is not None and remaining <= 0 and reset is not None:
+            # Some APIs send the reset as an epoch time rather than seconds left
+            now = time.time()
+            delay = reset - now if reset > now else reset
+        if delay is not None:
+            delay = min(max(delay, 0.0), MAX_PAUSE_SECONDS)
+        with self._condition:
+            if remaining is not None:
+                # The server's view of the quota wins over our local estimate
+                self._tokens = min(self._tokens, remaining)
+            if delay is not None:
+                self.throttled += 1
+                self._tokens = 0
+                self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+                logger.warning(f"Rate limit reached, pausing for {delay:.1f}s")
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _ in self._waiters:
+                depth[PRIORITY_NAMES[priority]] += 1
+            avg_wait_seconds = {
+                name: self.total_wait_seconds[name] / count if count else 0.0
+                for name, count in self.acquired.items()
+            }
+            return {
+                "tokens": self._tokens,
+                "queue_depth": depth,
+                "acquired": dict(self.acquired),
+                "avg_wait_seconds": avg_wait_seconds,
+                "max_wait_seconds": dict(self.max_wait_seconds),
+                "throttled": self.throttled,
+            }
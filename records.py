@@ -0,0 +1,34 @@
+class OrderLine:
+    __slots__ = ("listPrice", "quantity", "productId")
+
+    def __init__(self, listPrice, quantity, productId) -> None:
+        self.listPrice = listPrice
+        self.quantity = quantity
+        self.productId = productId
+
+    def __repr__(self):
+        return (
+            f"OrderLine(listPrice={self.listPrice!r}, quantity={self.quantity!r}, "
+            f"productId={self.productId!r})"
+        )
+
+
+def strip_attributes(records):
+    return [{k: v for k, v in r.items() if k != "attributes"} for r in records]
+
+
+def aggregate_order_lines(order_items):
+    # Sum quantities per (order, product code) and keep the first price seen
+    orders_lines = {}
+    for item in order_items:
+        if item["Product_Code__c"] is None:
+            continue
+        lines = orders_lines.setdefault(item["OrderId"], {})
+        line = lines.get(item["Product_Code__c"])
+        if line is None:
+            lines[item["Product_Code__c"]] = OrderLine(
+                item["ListPrice"], item["Quantity"], item["Product2Id"]
+            )
+        else:
+            line.quantity += item["Quantity"]
+    return orders_lines
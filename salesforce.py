@@ -1,267 +1,272 @@
 from simple_salesforce import Salesforce
-from config import SALESFORCE_PASSWORD, SALESFORCE_SECURITY_TOKEN, SALESFORCE_USERNAME
+from config import (
+    SALESFORCE_PASSWORD,
+    SALESFORCE_POLL_MAX_PAGES,
+    SALESFORCE_POLL_PAGE_SIZE,
+    SALESFORCE_PRODUCT_EXTERNAL_ID_FIELD,
+    SALESFORCE_SECURITY_TOKEN,
+    SALESFORCE_USERNAME,
+)
 from datetime import datetime, timedelta
-import pandas as pd
 import pytz
+import threading
 import uuid
 from inflow import Inflow
 import logging
-import requests
-from utils import variables_nonetype_conversion_to_string
+import transport
+from order_mapping import MappingContext, transform_order
+from records import strip_attributes
+from cursors import cursor_store
+from utils import chunked, parse_salesforce_timestamp, soql_datetime
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SOQL_IN_CHUNK_SIZE = 200
+SOBJECT_COLLECTION_SIZE = 200
+ORDERS_CURSOR_STREAM = "salesforce_orders"
+ACCOUNTS_CURSOR_STREAM = "salesforce_accounts"
+ENRICHED_ORDER_FIELDS = """Id, SystemModstamp, AccountId, OrderNumber, Name, Shipping_Date__c, ShippingAddress, ShipToContactId,
+            Account.Name, Account.Website,
+            ShipToContact.Email, ShipToContact.Name, ShipToContact.Phone,
+            (SELECT ListPrice, Quantity, Product2Id, Product_Code__c, OrderId
+            FROM OrderItems WHERE Product2.InFlow__c = True)"""
+
 
 class SalesForce:
-    def __init__(self) -> None:
-        self.sf = Salesforce(
-            username=SALESFORCE_USERNAME,
-            password=SALESFORCE_PASSWORD,
-            security_token=SALESFORCE_SECURITY_TOKEN,
-        )
+    def __init__(self, inflow=None, sf=None) -> None:
+        self.inflow = inflow or Inflow()
+        self._sf = sf
+        self._sf_lock = threading.Lock()
+
+    @property
+    def sf(self):
+        # Logging in is a round trip, so it waits for the first call that needs it
+        if self._sf is None:
+            with self._sf_lock:
+                if self._sf is None:
+                    self._sf = Salesforce(
+                        username=SALESFORCE_USERNAME,
+                        password=SALESFORCE_PASSWORD,
+                        security_token=SALESFORCE_SECURITY_TOKEN,
+                        session=transport.get_session("salesforce"),
+                    )
+        return self._sf
 
-    def get_latest_order_status_update(self):
+    def get_latest_order_status_updates(self):
         try:
             now = datetime.now(pytz.utc)
-            one_minute_ago = now - timedelta(minutes=1)
-            one_minute_ago_str = (
-                one_minute_ago.strftime("%Y-%m-%dT%H:%M:%S.")
-                + f"{one_minute_ago.microsecond // 1000:03d}Z"
+            orders, cursor = self.query_since_cursor(
+                ORDERS_CURSOR_STREAM,
+                ENRICHED_ORDER_FIELDS,
+                "Order",
+                "SystemModstamp",
+                "Status = 'Approved to Ship'",
             )
+            if len(orders) == 0:
+                logger.info("No latest status updates in orders")
+                return [], False, None
+            for order in orders:
+                order["OrderItems"] = self.get_all_child_records(order["OrderItems"])
+            bodies = self.build_inflow_order_bodies(orders, now)
+            # The caller saves the cursor once the bodies are queued
+            return bodies, len(bodies) > 0, cursor
+        except Exception as e:
+            logger.error(f"Error getting latest order status update: {e}")
+            return [], False, None
+
+    def query_since_cursor(
+        self, stream, fields, sobject, order_field, where_clause=None
+    ):
+        # Keyset pagination on (order_field, Id), so nothing is skipped or
+        # repeated however late or early a poll runs
+        cursor = cursor_store.get(stream)
+        if cursor is None:
+            one_minute_ago = datetime.now(pytz.utc) - timedelta(minutes=1)
+            cursor = {"timestamp": soql_datetime(one_minute_ago), "id": None}
+        records = []
+        for _ in range(SALESFORCE_POLL_MAX_PAGES):
+            ts = cursor["timestamp"]
+            if cursor["id"] is None:
+                cursor_clause = f"{order_field} >= {ts}"
+            else:
+                cursor_clause = (
+                    f"({order_field} > {ts} "
+                    f"OR ({order_field} = {ts} AND Id > '{cursor['id']}'))"
+                )
+            if where_clause is not None:
+                cursor_clause = f"{where_clause} AND {cursor_clause}"
             query = f"""
-            SELECT Id, AccountId, OrderNumber, Name, Shipping_Date__c, ShippingAddress, ShipToContactId 
+            SELECT {fields}
+            FROM {sobject} 
+            WHERE {cursor_clause}
+            ORDER BY {order_field}, Id
+            LIMIT {SALESFORCE_POLL_PAGE_SIZE}
+            """
+            page = self.sf.query_all(query)["records"]
+            records.extend(page)
+            if page:
+                last = page[-1]
+                cursor = {
+                    "timestamp": soql_datetime(
+                        parse_salesforce_timestamp(last[order_field])
+                    ),
+                    "id": last["Id"],
+                }
+            if len(page) < SALESFORCE_POLL_PAGE_SIZE:
+                break
+        else:
+            logger.info(f"{stream} has more changes, continuing next poll")
+        return records, cursor
+
+    def fetch_orders_by_ids(self, order_ids):
+        now = datetime.now(pytz.utc)
+        orders = []
+        for chunk in chunked(list(order_ids), SOQL_IN_CHUNK_SIZE):
+            ids = ", ".join(f"'{order_id}'" for order_id in chunk)
+            query = f"""
+            SELECT {ENRICHED_ORDER_FIELDS}
             FROM Order 
-            WHERE LastModifiedDate >= {one_minute_ago_str}
+            WHERE Id IN ({ids})
             AND Status = 'Approved to Ship'
             """
-            results = self.sf.query(query)["records"]
-            results_df = pd.DataFrame.from_dict(results)
-            if len(results_df) == 0:
-                logger.info("No latest status updates in orders")
-                return {}, False
-            results_df.drop("attributes", axis=1, inplace=True)
-            account_id = results_df.iloc[0]["AccountId"]
-            company_name, website = self.get_company_details(account_id)
-            contact_id = results_df.iloc[0]["ShipToContactId"]
-            if contact_id is None:
-                contact_email, contact_name, contact_phone = "", "", ""
-            else:
-                contact_email, contact_name, contact_phone = (
-                    self.get_customer_contact_details(contact_id)
-                )
-            inflow = Inflow()
-            inflow_customers = inflow.get_inflow_customers()
-            customer_id = ""
-            if company_name in inflow_customers:
-                customer_id = inflow_customers[company_name]
-            orderNumber = results_df.iloc[0]["OrderNumber"]
-            shipping_address = results_df.iloc[0]["ShippingAddress"]
-            order_remarks = ""
-            if shipping_address is None:
-                address, city, country, postalCode, state = "Hand Carry", "", "", "", ""
-                order_remarks = "Hand Carry"
-            else:
-                address = shipping_address["street"]
-                city = shipping_address["city"]
-                country = shipping_address["country"]
-                postalCode = shipping_address["postalCode"]
-                state = shipping_address["state"]
-            possible_nonetype_array = [
-                website,
-                contact_email,
-                contact_name,
-                contact_phone,
-                address,
-                city,
-                country,
-                postalCode,
-                state,
-            ]
-            (
-                website,
-                contact_email,
-                contact_name,
-                contact_phone,
-                address,
-                city,
-                country,
-                postalCode,
-                state,
-            ) = variables_nonetype_conversion_to_string(*possible_nonetype_array)
-            order_id = results_df.iloc[0]["Id"]
-            salesforce_order_products = self.get_order_products(order_id)
-            inflow_products = inflow.get_inflow_products()
-            salesOrderId = f"{uuid.uuid4()}"
-            linesArray = []
-            for sf_k in salesforce_order_products:
-                matches = [key for key in inflow_products if sf_k in key]
-                for match in matches:
-                    if inflow_products[match]["activeRevision"] == "Yes":
-                        salesOrderLineId = f"{uuid.uuid4()}"
-                        lineBody = {
-                            "productId": inflow_products[match]["productId"],
-                            "salesOrderLineId": salesOrderLineId,
-                            "quantity": {
-                                "uomQuantity": str(
-                                    salesforce_order_products[sf_k]["quantity"]
-                                )
-                            },
-                            "unitPrice": str(salesforce_order_products[sf_k]["listPrice"]),
-                        }
-                        linesArray.append(lineBody)
-            body = {
-                "salesOrderId": salesOrderId,
-                "contactName": contact_name,
-                "customer": {"customerId": customer_id, "website": website},
-                "customerId": customer_id,
-                "customFields": {"custom1": order_id},
-                "email": contact_email,
-                "inventoryStatus": "Started",
-                "invoicedDate": None,
-                "isCompleted": False,
-                "lines": linesArray,
-                "orderDate": now.strftime("%Y-%m-%d"),
-                "orderNumber": f"SO-{orderNumber}",
-                "orderRemarks": order_remarks,
-                "phone": contact_phone,
-                "requestedShipDate": None,
-                "shippedDate": None,
-                "shippingAddress": {
-                    "address1": address,
-                    "city": city,
-                    "state": state,
-                    "country": country,
-                    "postalCode": postalCode,
-                    "remarks": "",
-                },
-                "shipRemarks": "",
-                "shipToCompanyName": company_name,
-                "source": "salesforce",
-            }
-            return body, True
-        except Exception as e:
-            logger.error(f"Error getting latest order status update: {e}")
-            return {}, False
+            orders.extend(self.sf.query_all(query)["records"])
+        for order in orders:
+            order["OrderItems"] = self.get_all_child_records(order["OrderItems"])
+        return self.build_inflow_order_bodies(orders, now)
 
-    def get_company_details(self, account_id):
-        query = f""" SELECT Name, Website FROM Account 
-        WHERE Id = '{account_id}'"""
-        results = self.sf.query(query)["records"]
-        results_df = pd.DataFrame.from_dict(results)
-        results_df.drop("attributes", axis=1, inplace=True)
-        name = results_df.iloc[0]["Name"]
-        website = results_df.iloc[0]["Website"]
-        return name, website
+    def get_all_child_records(self, child_result):
+        if child_result is None:
+            return []
+        records = child_result["records"]
+        # Subqueries are paged separately once an order has more than 200 lines
+        while not child_result["done"]:
+            child_result = self.sf.query_more(
+                child_result["nextRecordsUrl"], identifier_is_url=True
+            )
+            records.extend(child_result["records"])
+        return records
 
-    def get_order_products(self, order_id):
-        query = f""" SELECT ListPrice, Quantity, Product2Id, Product_Code__c, OrderId FROM OrderItem 
-        WHERE OrderId = '{order_id}'"""
-        results = self.sf.query(query)["records"]
-        order_products_df = pd.DataFrame.from_dict(results)
-        order_products_df.drop("attributes", axis=1, inplace=True)
-        order_products_df = order_products_df.groupby(
-            "Product_Code__c", as_index=False
-        ).agg(
-            {
-                "Quantity": "sum",
-                "ListPrice": "first",
-                "Product2Id": "first",
-                "OrderId": "first",
-            }
-        )
-        query = f""" SELECT Id, InFlow__c From Product2 WHERE InFlow__c = True"""
-        results = self.sf.query(query)["records"]
-        products_df = pd.DataFrame.from_dict(results)
-        products_df.drop("attributes", axis=1, inplace=True)
-        results_df_final = pd.merge(
-            products_df,
-            order_products_df,
-            left_on="Id",
-            right_on="Product2Id",
-            how="inner",
+    def build_inflow_order_bodies(self, orders, now):
+        ctx = MappingContext(
+            self.inflow.customers_state,
+            self.inflow.products_state,
+            self.inflow.sku_index,
+            now,
         )
-        order_products_dict = {}
-        for row in results_df_final.itertuples():
-            order_products_dict[row.Product_Code__c] = {
-                "listPrice": row.ListPrice,
-                "quantity": row.Quantity,
-                "productId": row.Product2Id,
-            }
-        return order_products_dict
+        bodies = []
+        for order in orders:
+            try:
+                bodies.append(transform_order(order, ctx))
+            except Exception as e:
+                order_number = order["OrderNumber"]
+                logger.error(f"Error building inflow order {order_number}: {e}")
+        logger.info(f"Built {len(bodies)} of {len(orders)} changed orders")
+        return bodies
 
-    def update_order_status(self, order_id, tracking_numbers, order_number):
-        order_data = {"Status": "Shipped", "Tracking_Number_s__c": tracking_numbers}
-        try:
-            url = f"https://{self.sf.sf_instance}/services/data/v59.0/sobjects/Order/{order_id}"
-            headers = {
-                "Authorization": f"Bearer {self.sf.session_id}",
-                "Content-Type": "application/json",
-            }
-            response = requests.patch(url, headers=headers, json=order_data, timeout=10)
-            if response.status_code in [200, 204]:
-                logger.info(f"Order {order_number} status updated to 'Shipped'.")
-                return True, response.text
-            else:
-                logger.error(
-                    f"Failed to update order {order_number}. "
-                    f"Status: {response.status_code}, Response: {response.text}"
+    def update_order_statuses(self, updates):
+        # updates are (order_id, tracking_numbers, order_number), sent as
+        # sObject Collections of 200 with one result per order
+        results = []
+        url = f"{self.sf.base_url}composite/sobjects"
+        headers = {
+            "Authorization": f"Bearer {self.sf.session_id}",
+            "Content-Type": "application/json",
+        }
+        for chunk in chunked(updates, SOBJECT_COLLECTION_SIZE):
+            records = [
+                {
+                    "attributes": {"type": "Order"},
+                    "id": order_id,
+                    "Status": "Shipped",
+                    "Tracking_Number_s__c": tracking_numbers,
+                }
+                for order_id, tracking_numbers, _ in chunk
+            ]
+            try:
+                response = transport.request(
+                    "PATCH",
+                    url,
+                    headers=headers,
+                    json={"allOrNone": False, "records": records},
                 )
-                return False, response.text
-        except Exception as e:
-            logger.exception(f"Error updating order {order_number}: {e}")
+                if response.status_code != 200:
+                    raise Exception(f"{response.status_code} {response.text}")
+                for (_, _, order_number), result in zip(chunk, response.json()):
+                    if result["success"]:
+                        logger.info(
+                            f"Order {order_number} status updated to 'Shipped'."
+                        )
+                        results.append((True, order_number, "success"))
+                    else:
+                        logger.error(f"Failed to update order {order_number}: {result}")
+                        results.append((False, order_number, result["errors"]))
+            except Exception as e:
+                logger.error(f"Error updating orders: {e}")
+                results.extend((False, order_number, e) for _, _, order_number in chunk)
+        return results
 
-    def get_latest_customer(self):
+    def get_latest_customers(self):
         try:
-            now = datetime.now(pytz.utc)
-            one_minute_ago = now - timedelta(minutes=1)
-            one_minute_ago_str = (
-                one_minute_ago.strftime("%Y-%m-%dT%H:%M:%S.")
-                + f"{one_minute_ago.microsecond // 1000:03d}Z"
+            results, cursor = self.query_since_cursor(
+                ACCOUNTS_CURSOR_STREAM,
+                "Id, Name, CreatedDate",
+                "Account",
+                "CreatedDate",
             )
-            query = f"""
-            SELECT Name 
-            FROM Account 
-            WHERE CreatedDate >= {one_minute_ago_str}
-            """
-            results = self.sf.query(query)["records"]
-            results_df = pd.DataFrame.from_dict(results)
-            if len(results_df) == 0:
+            results = strip_attributes(results)
+            if len(results) == 0:
                 logger.info("No latest creation of customers")
-                return {}, False
-            results_df.drop("attributes", axis=1, inplace=True)
-            name = results_df.iloc[0]["Name"]
-            customerId = uuid.uuid4()
-            body = {"name": name, "customerId": f"{customerId}"}
-            return body, True
+                return [], False, None
+            bodies = [self.build_inflow_customer_body(r["Name"]) for r in results]
+            return bodies, True, cursor
         except Exception as e:
             logger.error(f"Error getting latest customer creation: {e}")
-            return {}, False
+            return [], False, None
 
-    def create_product(self, body):
-        product_data = {
-            "Name": body["name"],
-            "List_Price__c": body["listPrice"],
-            "ProductCode": body["sku"],
-        }
-        try:
-            self.sf.Product2.create(product_data)
-            name = body["name"]
-            logger.info(f"Product {name} created.")
-            return True, name, "success"
-        except Exception as e:
-            logger.error(f"Error creating product: {e}")
-            return False, name, e
+    def build_inflow_customer_body(self, name):
+        return {"name": name, "customerId": f"{uuid.uuid4()}"}
 
-    def get_customer_contact_details(self, contact_id):
-        query = f"""
-        SELECT Email, Name, Phone
-        FROM Contact 
-        WHERE Id = '{contact_id}'
-        """
-        results = self.sf.query(query)["records"]
-        results_df = pd.DataFrame.from_dict(results)
-        email = results_df.iloc[0]["Email"]
-        name = results_df.iloc[0]["Name"]
-        phone = results_df.iloc[0]["Phone"]
-        return email, name, phone
+    def create_products(self, bodies):
+        # sObject Collections upsert, 200 records per call, one result per record
+        results = []
+        url = (
+            f"{self.sf.base_url}composite/sobjects/"
+            f"Product2/{SALESFORCE_PRODUCT_EXTERNAL_ID_FIELD}"
+        )
+        headers = {
+            "Authorization": f"Bearer {self.sf.session_id}",
+            "Content-Type": "application/json",
+        }
+        for chunk in chunked(bodies, SOBJECT_COLLECTION_SIZE):
+            records = [
+                {
+                    "attributes": {"type": "Product2"},
+                    "Name": body["name"],
+                    "List_Price__c": body["listPrice"],
+                    "ProductCode": body["sku"],
+                    SALESFORCE_PRODUCT_EXTERNAL_ID_FIELD: body["sku"],
+                }
+                for body in chunk
+            ]
+            try:
+                response = transport.request(
+                    "PATCH",
+                    url,
+                    headers=headers,
+                    json={"allOrNone": False, "records": records},
+                )
+                if response.status_code != 200:
+                    raise Exception(f"{response.status_code} {response.text}")
+                for body, result in zip(chunk, response.json()):
+                    name = body["name"]
+                    if result["success"]:
+                        logger.info(f"Product {name} created.")
+                        results.append((True, name, "success"))
+                    else:
+                        logger.error(f"Error creating product {name}: {result}")
+                        results.append((False, name, result["errors"]))
+            except Exception as e:
+                logger.error(f"Error creating products: {e}")
+                results.extend((False, body["name"], e) for body in chunk)
+        return results
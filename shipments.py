@@ -0,0 +1,233 @@
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    SHIPMENT_BACKEND,
+    SHIPMENT_CLAIM_SECONDS,
+    SHIPMENT_MAX_ENTRIES,
+    SHIPMENT_RETENTION_SECONDS,
+    SHIPMENTS_SQLITE_PATH,
+)
+from sqlite_store import SqliteStore
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CLAIMED = "claimed"
+SHIPPED = "shipped"
+
+
+def is_shipped(response):
+    return response["isCompleted"] == True and response["shippedDate"] != None
+
+
+def shipment_update(response):
+    # The Salesforce order id, tracking numbers and order number for the
+    # Order update, taken from an Inflow sales order with its shipLines
+    tracking_numbers = ""
+    if len(response["shipLines"]) == 1:
+        tracking_numbers = response["shipLines"][0]["trackingNumber"]
+    else:
+        for shipline in response["shipLines"]:
+            tracking_numbers = tracking_numbers + shipline["trackingNumber"] + ","
+        tracking_numbers = tracking_numbers[:-1]
+    order_id = response["customFields"]["custom1"]
+    order_number = response["orderNumber"]
+    return [order_id, tracking_numbers, order_number]
+
+
+# What has been propagated to Salesforce per Inflow salesOrderId, so webhook
+# events for shipped orders are dropped before any call to Inflow
+class ShipmentTracker(SqliteStore):
+    PURGE_EVERY = 1000
+
+    def __init__(self, path, claim_seconds, retention_seconds) -> None:
+        super().__init__(path)
+        self.claim_seconds = claim_seconds
+        self.retention_seconds = retention_seconds
+        self._shipped = 0
+        self._connection().execute(
+            """
+            CREATE TABLE IF NOT EXISTS shipments (
+                sales_order_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                rechecks INTEGER NOT NULL DEFAULT 0,
+                order_number TEXT,
+                tracking_numbers TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+
+    def claim(self, sales_order_id):
+        # True hands the order to the caller. Shipped orders are refused, and so
+        # are orders another worker holds, which are flagged for it to recheck.
+        # A claim left behind by a crash lapses after claim_seconds.
+        now = time.time()
+        connection = self._connection()
+        cursor = connection.execute(
+            """
+            INSERT INTO shipments (sales_order_id, state, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (sales_order_id) DO UPDATE
+            SET state = excluded.state, rechecks = 0,
+                updated_at = excluded.updated_at
+            WHERE shipments.state = ? AND shipments.updated_at <= ?
+            """,
+            (sales_order_id, CLAIMED, now, CLAIMED, now - self.claim_seconds),
+        )
+        if cursor.rowcount == 1:
+            return True
+        connection.execute(
+            "UPDATE shipments SET rechecks = 1 WHERE sales_order_id = ? AND state = ?",
+            (sales_order_id, CLAIMED),
+        )
+        return False
+
+    def release(self, sales_order_id):
+        # Gives up a claim on an order that hasn't shipped. True means another
+        # event came in meanwhile, so the caller keeps the claim and looks again.
+        connection = self._connection()
+        cursor = connection.execute(
+            """
+            DELETE FROM shipments
+            WHERE sales_order_id = ? AND state = ? AND rechecks = 0
+            """,
+            (sales_order_id, CLAIMED),
+        )
+        if cursor.rowcount == 1:
+            return False
+        cursor = connection.execute(
+            """
+            UPDATE shipments SET rechecks = 0, updated_at = ?
+            WHERE sales_order_id = ? AND state = ? AND rechecks = 1
+            """,
+            (time.time(), sales_order_id, CLAIMED),
+        )
+        return cursor.rowcount == 1
+
+    def forget(self, sales_order_id):
+        self._connection().execute(
+            "DELETE FROM shipments WHERE sales_order_id = ? AND state = ?",
+            (sales_order_id, CLAIMED),
+        )
+
+    def mark_shipped(self, sales_order_id, order_number, tracking_numbers):
+        self._connection().execute(
+            """
+            INSERT OR REPLACE INTO shipments
+            (sales_order_id, state, order_number, tracking_numbers, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (sales_order_id, SHIPPED, order_number, tracking_numbers, time.time()),
+        )
+        self._shipped += 1
+        if self._shipped % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def purge_expired(self):
+        cursor = self._connection().execute(
+            "DELETE FROM shipments WHERE state = ? AND updated_at <= ?",
+            (SHIPPED, time.time() - self.retention_seconds),
+        )
+        logger.info(f"Purged {cursor.rowcount} old shipments")
+
+    def stats(self):
+        rows = self._connection().execute(
+            "SELECT state, COUNT(*) FROM shipments GROUP BY state"
+        )
+        return {CLAIMED: 0, SHIPPED: 0, **dict(rows)}
+
+
+# Same contract as ShipmentTracker, held in an LRU bounded by max_entries.
+# Only dedups within one process and is lost on restart.
+class MemoryShipmentTracker:
+    def __init__(self, max_entries, claim_seconds, retention_seconds) -> None:
+        self.max_entries = max_entries
+        self.claim_seconds = claim_seconds
+        self.retention_seconds = retention_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _set(self, sales_order_id, entry):
+        self._entries[sales_order_id] = entry
+        self._entries.move_to_end(sales_order_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def claim(self, sales_order_id):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(sales_order_id)
+            if entry is not None and entry["state"] == SHIPPED:
+                if entry["updated_at"] > now - self.retention_seconds:
+                    return False
+            elif entry is not None and entry["updated_at"] > now - self.claim_seconds:
+                entry["rechecks"] = 1
+                return False
+            self._set(
+                sales_order_id, {"state": CLAIMED, "rechecks": 0, "updated_at": now}
+            )
+            return True
+
+    def release(self, sales_order_id):
+        with self._lock:
+            entry = self._entries.get(sales_order_id)
+            if entry is None or entry["state"] != CLAIMED:
+                return False
+            if entry["rechecks"] == 0:
+                del self._entries[sales_order_id]
+                return False
+            entry["rechecks"] = 0
+            entry["updated_at"] = time.time()
+            return True
+
+    def forget(self, sales_order_id):
+        with self._lock:
+            entry = self._entries.get(sales_order_id)
+            if entry is not None and entry["state"] == CLAIMED:
+                del self._entries[sales_order_id]
+
+    def mark_shipped(self, sales_order_id, order_number, tracking_numbers):
+        with self._lock:
+            self._set(
+                sales_order_id,
+                {
+                    "state": SHIPPED,
+                    "order_number": order_number,
+                    "tracking_numbers": tracking_numbers,
+                    "updated_at": time.time(),
+                },
+            )
+
+    def purge_expired(self):
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            expired = [
+                key
+                for key, entry in self._entries.items()
+                if entry["state"] == SHIPPED and entry["updated_at"] <= cutoff
+            ]
+            for key in expired:
+                del self._entries[key]
+        logger.info(f"Purged {len(expired)} old shipments")
+
+    def stats(self):
+        with self._lock:
+            stats = {CLAIMED: 0, SHIPPED: 0}
+            for entry in self._entries.values():
+                stats[entry["state"]] += 1
+            return stats
+
+
+def create_shipment_tracker():
+    if SHIPMENT_BACKEND == "sqlite":
+        return ShipmentTracker(
+            SHIPMENTS_SQLITE_PATH, SHIPMENT_CLAIM_SECONDS, SHIPMENT_RETENTION_SECONDS
+        )
+    if SHIPMENT_BACKEND == "memory":
+        return MemoryShipmentTracker(
+            SHIPMENT_MAX_ENTRIES, SHIPMENT_CLAIM_SECONDS, SHIPMENT_RETENTION_SECONDS
+        )
+    raise ValueError(f"Unknown SHIPMENT_BACKEND: {SHIPMENT_BACKEND}")
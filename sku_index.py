@@ -0,0 +1,31 @@
+import threading
+from bisect import bisect_left, insort
+
+
+class SkuIndex:
+    def __init__(self, products) -> None:
+        self.products = products
+        self._lock = threading.Lock()
+        self._skus = sorted(
+            sku for sku, v in products.items() if v["activeRevision"] == "Yes"
+        )
+
+    def update(self, sku, product):
+        with self._lock:
+            i = bisect_left(self._skus, sku)
+            is_indexed = i < len(self._skus) and self._skus[i] == sku
+            is_active = product is not None and product["activeRevision"] == "Yes"
+            if is_active and not is_indexed:
+                insort(self._skus, sku)
+            elif is_indexed and not is_active:
+                del self._skus[i]
+
+    def match(self, prefix):
+        # SKUs sharing a prefix are contiguous in sorted order
+        with self._lock:
+            matches = []
+            i = bisect_left(self._skus, prefix)
+            while i < len(self._skus) and self._skus[i].startswith(prefix):
+                matches.append(self._skus[i])
+                i += 1
+            return matches
@@ -1,157 +1,216 @@
+import atexit
+import queue
+import threading
+import time
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
-from config import SLACK_BOT_TOKEN, SLACK_CHANNEL_ID
+from slack_sdk.http_retry.builtin_handlers import (
+    ConnectionErrorRetryHandler,
+    RateLimitErrorRetryHandler,
+)
+from config import (
+    HTTP_MAX_RETRIES,
+    HTTP_READ_TIMEOUT_SECONDS,
+    METRICS_ENABLED,
+    SLACK_BOT_TOKEN,
+    SLACK_CHANNEL_ID,
+    SLACK_COALESCE_SECONDS,
+)
+from transport import record_request
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# kind: (title for one event, title for several, fallback text)
+MESSAGE_KINDS = {
+    "inflow_order_created": (
+        "Inflow Order Created",
+        "Inflow Orders Created",
+        "inflow order created message",
+    ),
+    "inflow_order_error": (
+        "Error creating Inflow Order",
+        "Errors creating Inflow Orders",
+        "inflow order error message",
+    ),
+    "inflow_customer_created": (
+        "Inflow Customer Created",
+        "Inflow Customers Created",
+        "inflow customer created message",
+    ),
+    "inflow_customer_error": (
+        "Error creating Inflow Customer",
+        "Errors creating Inflow Customers",
+        "inflow customer error message",
+    ),
+    "salesforce_product_created": (
+        "Salesforce Product Created",
+        "Salesforce Products Created",
+        "salesforce product created message",
+    ),
+    "salesforce_product_error": (
+        "Error creating Salesforce Product",
+        "Errors creating Salesforce Products",
+        "salesforce product error message",
+    ),
+    "salesforce_order_updated": (
+        "Salesforce Order Updated",
+        "Salesforce Orders Updated",
+        "salesforce order updated message",
+    ),
+    "salesforce_order_error": (
+        "Error updating Salesforce Order",
+        "Errors updating Salesforce Orders",
+        "salesforce order error message",
+    ),
+}
+# Slack caps a message at 50 blocks and a section at 3000 characters
+MAX_BLOCKS = 50
+MAX_SECTION_CHARS = 3000
+
 
 class Slack:
     def __init__(self) -> None:
-        self.client = WebClient(token=SLACK_BOT_TOKEN)
+        # slack_sdk runs on urllib rather than requests, so it can't share a
+        # transport session; mirror its timeout and retry policy instead
+        self.client = WebClient(
+            token=SLACK_BOT_TOKEN,
+            timeout=int(HTTP_READ_TIMEOUT_SECONDS),
+            retry_handlers=[
+                ConnectionErrorRetryHandler(max_retry_count=HTTP_MAX_RETRIES),
+                RateLimitErrorRetryHandler(max_retry_count=HTTP_MAX_RETRIES),
+            ],
+        )
         self.channel = SLACK_CHANNEL_ID
+        self.coalesce_seconds = SLACK_COALESCE_SECONDS
+        self.events = queue.Queue()
+        self.dispatcher = threading.Thread(
+            target=self.dispatch, name="slack-dispatcher", daemon=True
+        )
+        self.dispatcher.start()
+        atexit.register(self.flush)
 
-    def send_inflow_order_created_message(self, order_number):
+    def notify(self, kind, item, error=None):
+        self.events.put((kind, item, error))
+
+    def dispatch(self):
+        while True:
+            batch = [self.events.get()]
+            # Anything else that arrives inside the window rides along
+            deadline = time.monotonic() + self.coalesce_seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.events.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.send_batch(batch)
+            except Exception as e:
+                logger.exception(f"Error sending slack notifications: {e}")
+            for _ in batch:
+                self.events.task_done()
+
+    def flush(self):
+        self.events.join()
+
+    def send_batch(self, batch):
+        grouped = {}
+        for kind, item, error in batch:
+            grouped.setdefault(kind, []).append((item, error))
+        for kind, events in grouped.items():
+            single_title, plural_title, text = MESSAGE_KINDS[kind]
+            if len(events) == 1:
+                item, error = events[0]
+                line = f"*{single_title}*: {item}"
+                if error is not None:
+                    line += f"\nError Message: {error}"
+                self.post_message([line], text)
+                continue
+            lines = [f"*{len(events)} {plural_title}*:"]
+            for item, error in events:
+                line = f"• {item}"
+                if error is not None:
+                    line += f"\n    Error Message: {error}"
+                lines.append(line)
+            self.post_message(lines, f"{len(events)} {text}s")
+
+    def post_message(self, lines, text):
+        sections = []
+        for line in lines:
+            line = line[:MAX_SECTION_CHARS]
+            if sections and len(sections[-1]) + len(line) + 1 <= MAX_SECTION_CHARS:
+                sections[-1] += f"\n{line}"
+            else:
+                sections.append(line)
+        for i in range(0, len(sections), MAX_BLOCKS):
+            blocks = [
+                {"type": "section", "text": {"type": "mrkdwn", "text": section}}
+                for section in sections[i : i + MAX_BLOCKS]
+            ]
+            self.post_blocks(blocks, text)
+
+    def post_blocks(self, blocks, text):
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            try:
+                self.chat_post_message(blocks, text)
+                return
+            except SlackApiError as e:
+                # The client's own retries are spent, so back off on this thread
+                if e.response.status_code != 429 or attempt == HTTP_MAX_RETRIES:
+                    logger.error(f"Error sending {text} slack message: {e}")
+                    return
+                retry_after = int(e.response.headers.get("Retry-After", 1))
+                logger.warning(f"Slack rate limited, retrying in {retry_after}s")
+                time.sleep(retry_after)
+
+    def chat_post_message(self, blocks, text):
+        # Record the call with the other outbound requests on /metrics; one
+        # sample per call, since the client's own retries happen inside it
+        if not METRICS_ENABLED:
+            return self.client.chat_postMessage(
+                channel=self.channel, blocks=blocks, text=text
+            )
+        url = f"{self.client.base_url}chat.postMessage"
+        started_at = time.perf_counter()
         try:
-            self.client.chat_postMessage(
-                channel=self.channel,
-                blocks=[
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"*Inflow Order Created*: {order_number}",
-                        },
-                    },
-                ],
-                text="inflow order created message",
+            response = self.client.chat_postMessage(
+                channel=self.channel, blocks=blocks, text=text
             )
         except SlackApiError as e:
-            logger.error(f"Error sending Inflow Order created slack message: {e}")
+            seconds = time.perf_counter() - started_at
+            record_request("POST", url, seconds, e.response.status_code)
+            raise
+        except Exception:
+            record_request("POST", url, time.perf_counter() - started_at)
+            raise
+        seconds = time.perf_counter() - started_at
+        record_request("POST", url, seconds, response.status_code)
+        return response
+
+    def send_inflow_order_created_message(self, order_number):
+        self.notify("inflow_order_created", order_number)
 
     def send_inflow_order_created_error_message(self, order_number, error):
-        try:
-            self.client.chat_postMessage(
-                channel=self.channel,
-                blocks=[
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"*Error creating Inflow Order*: {order_number}\nError Message: {error}",
-                        },
-                    },
-                ],
-                text="inflow order error message",
-            )
-        except SlackApiError as e:
-            logger.error(f"Error sending Inflow Order slack error message: {e}")
+        self.notify("inflow_order_error", order_number, error)
 
     def send_inflow_customer_created_message(self, customer):
-        try:
-            self.client.chat_postMessage(
-                channel=self.channel,
-                blocks=[
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"*Inflow Customer Created*: {customer}",
-                        },
-                    },
-                ],
-                text="inflow customer created message",
-            )
-        except SlackApiError as e:
-            logger.error(f"Error sending Inflow Customer created slack message: {e}")
+        self.notify("inflow_customer_created", customer)
 
     def send_inflow_customer_created_error_message(self, customer, error):
-        try:
-            self.client.chat_postMessage(
-                channel=self.channel,
-                blocks=[
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"*Error creating Inflow Customer*: {customer}\nError Message: {error}",
-                        },
-                    },
-                ],
-                text="inflow customer error message",
-            )
-        except SlackApiError as e:
-            logger.error(f"Error sending Inflow Customer slack error message: {e}")
+        self.notify("inflow_customer_error", customer, error)
 
     def send_salesforce_product_created_message(self, product):
-        try:
-            self.client.chat_postMessage(
-                channel=self.channel,
-                blocks=[
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"*Salesforce Product Created*: {product}",
-                        },
-                    },
-                ],
-                text="salesforce product created message",
-            )
-        except SlackApiError as e:
-            logger.error(f"Error sending Salesforce product created slack message: {e}")
+        self.notify("salesforce_product_created", product)
 
     def send_salesforce_product_created_error_message(self, product, error):
-        try:
-            self.client.chat_postMessage(
-                channel=self.channel,
-                blocks=[
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"*Error creating Salesforce Product*: {product}\nError Message: {error}",
-                        },
-                    },
-                ],
-                text="salesforce product error message",
-            )
-        except SlackApiError as e:
-            logger.error(f"Error sending Salesforce product slack error message: {e}")
+        self.notify("salesforce_product_error", product, error)
 
     def send_salesforce_order_updated_message(self, order_number):
-        try:
-            self.client.chat_postMessage(
-                channel=self.channel,
-                blocks=[
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"*Salesforce Order Updated*: {order_number}",
-                        },
-                    },
-                ],
-                text="salesforce order updated message",
-            )
-        except SlackApiError as e:
-            logger.error(f"Error sending Salesforce order updated slack message: {e}")
+        self.notify("salesforce_order_updated", order_number)
 
     def send_salesforce_order_updated_error_message(self, order_number, error):
-        try:
-            self.client.chat_postMessage(
-                channel=self.channel,
-                blocks=[
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"*Error updating Salesforce Order*: {order_number}\nError Message: {error}",
-                        },
-                    },
-                ],
-                text="salesforce order error message",
-            )
-        except SlackApiError as e:
-            logger.error(f"Error sending Salesforce order slack error message: {e}")
+        self.notify("salesforce_order_error", order_number, error)
@@ -0,0 +1,24 @@
+import os
+import sqlite3
+import threading
+
+
+# Base for the stores kept in a SQLite file: WAL so readers don't block the
+# writer, shared by every thread, worker process and restart
+class SqliteStore:
+    def __init__(self, path) -> None:
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().execute("PRAGMA journal_mode=WAL")
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads, so keep one each
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
@@ -0,0 +1,239 @@
+import itertools
+import queue
+import threading
+import time
+import transport
+from cursors import cursor_store
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ORDER_CHANGE_CHANNEL = "/data/OrderChangeEvent"
+ACCOUNT_CHANGE_CHANNEL = "/data/AccountChangeEvent"
+APPROVED_TO_SHIP = "Approved to Ship"
+# -1 asks for new events only, -2 for everything still retained (72h)
+REPLAY_NEW_EVENTS = -1
+COMETD_API_VERSION = "59.0"
+COMETD_READ_TIMEOUT_SECONDS = 130
+RECONNECT_MAX_DELAY_SECONDS = 60
+DISPATCH_ATTEMPTS = 5
+DISPATCH_RETRY_SECONDS = 1
+
+
+def dispatch(callback, data, replay_id):
+    # Retried in place so a transient failure doesn't let a later event's
+    # replay id be saved past this one
+    delay = DISPATCH_RETRY_SECONDS
+    for attempt in range(1, DISPATCH_ATTEMPTS + 1):
+        try:
+            callback(data, replay_id)
+            return
+        except Exception as e:
+            if attempt == DISPATCH_ATTEMPTS:
+                logger.exception(
+                    f"Dropping change event {replay_id} after {attempt} attempts: {e}"
+                )
+                return
+            logger.warning(
+                f"Error handling change event {replay_id}, retrying in {delay}s: {e}"
+            )
+            time.sleep(delay)
+            delay *= 2
+
+
+# Long-polling Bayeux client for the Salesforce Streaming API
+class CometDEventSource:
+    def __init__(self, salesforce) -> None:
+        self.salesforce = salesforce
+        # The Bayeux session is tied to cookies, so it gets its own session
+        self.session = transport.build_session()
+        self.subscriptions = {}
+        self.client_id = None
+        self.message_ids = itertools.count(1)
+        self.running = False
+
+    @property
+    def url(self):
+        return f"https://{self.salesforce.sf.sf_instance}/cometd/{COMETD_API_VERSION}"
+
+    def send(self, messages):
+        for message in messages:
+            message["id"] = str(next(self.message_ids))
+            if self.client_id is not None:
+                message["clientId"] = self.client_id
+        response = self.session.post(
+            self.url,
+            json=messages,
+            headers={"Authorization": f"Bearer {self.salesforce.sf.session_id}"},
+            timeout=(5, COMETD_READ_TIMEOUT_SECONDS),
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def subscribe(self, channel, replay_id, callback):
+        self.subscriptions[channel] = [replay_id, callback]
+
+    def handshake(self):
+        self.client_id = None
+        (reply,) = self.send(
+            [
+                {
+                    "channel": "/meta/handshake",
+                    "version": "1.0",
+                    "supportedConnectionTypes": ["long-polling"],
+                }
+            ]
+        )
+        if not reply["successful"]:
+            raise RuntimeError(f"CometD handshake failed: {reply}")
+        self.client_id = reply["clientId"]
+        replies = self.send(
+            [
+                {
+                    "channel": "/meta/subscribe",
+                    "subscription": channel,
+                    "ext": {"replay": {channel: replay_id}},
+                }
+                for channel, (replay_id, _) in self.subscriptions.items()
+            ]
+        )
+        for reply in replies:
+            if not reply.get("successful"):
+                raise RuntimeError(f"CometD subscribe failed: {reply}")
+        logger.info(f"Subscribed to {list(self.subscriptions)}")
+
+    def reconnect(self):
+        # Subscriptions resume from the last replay id each channel delivered
+        delay = 1
+        while self.running:
+            try:
+                self.handshake()
+                return
+            except Exception as e:
+                logger.error(f"CometD handshake failed, retrying in {delay}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY_SECONDS)
+
+    def run(self):
+        self.running = True
+        self.reconnect()
+        while self.running:
+            try:
+                messages = self.send(
+                    [{"channel": "/meta/connect", "connectionType": "long-polling"}]
+                )
+            except Exception as e:
+                logger.error(f"CometD connect failed, handshaking again: {e}")
+                self.reconnect()
+                continue
+            for message in messages:
+                channel = message.get("channel")
+                if channel == "/meta/connect":
+                    advice = message.get("advice") or {}
+                    must_handshake = advice.get("reconnect") == "handshake"
+                    if not message.get("successful") or must_handshake:
+                        self.reconnect()
+                elif channel in self.subscriptions:
+                    replay_id = message["data"]["event"]["replayId"]
+                    subscription = self.subscriptions[channel]
+                    subscription[0] = replay_id
+                    dispatch(subscription[1], message["data"], replay_id)
+
+    def stop(self):
+        self.running = False
+
+
+# In-memory event source with replay, for local runs and
+# checks/check_change_events.py
+class FakeEventSource:
+    def __init__(self) -> None:
+        self.events = {}
+        self.subscriptions = {}
+        self.pending = queue.Queue()
+        self.replay_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.running = False
+
+    def publish(self, channel, payload):
+        with self.lock:
+            replay_id = next(self.replay_ids)
+            data = {"event": {"replayId": replay_id}, "payload": payload}
+            self.events.setdefault(channel, []).append(data)
+        if channel in self.subscriptions:
+            self.pending.put((channel, data))
+        return replay_id
+
+    def subscribe(self, channel, replay_id, callback):
+        self.subscriptions[channel] = callback
+        if replay_id == REPLAY_NEW_EVENTS:
+            return
+        with self.lock:
+            retained = list(self.events.get(channel, []))
+        for data in retained:
+            if data["event"]["replayId"] > replay_id:
+                self.pending.put((channel, data))
+
+    def run(self):
+        self.running = True
+        while self.running:
+            try:
+                channel, data = self.pending.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            dispatch(self.subscriptions[channel], data, data["event"]["replayId"])
+            self.pending.task_done()
+
+    def stop(self):
+        self.running = False
+
+
+class ChangeEventConsumer:
+    def __init__(self, salesforce, source, on_orders, on_customers) -> None:
+        self.salesforce = salesforce
+        self.source = source
+        self.on_orders = on_orders
+        self.on_customers = on_customers
+
+    def replay_id(self, channel):
+        replay_id = cursor_store.get(f"replay:{channel}")
+        return REPLAY_NEW_EVENTS if replay_id is None else replay_id
+
+    def start(self):
+        self.source.subscribe(
+            ORDER_CHANGE_CHANNEL,
+            self.replay_id(ORDER_CHANGE_CHANNEL),
+            self.handle_order_event,
+        )
+        self.source.subscribe(
+            ACCOUNT_CHANGE_CHANNEL,
+            self.replay_id(ACCOUNT_CHANGE_CHANNEL),
+            self.handle_account_event,
+        )
+        thread = threading.Thread(
+            target=self.source.run, name="salesforce-change-events", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def handle_order_event(self, data, replay_id):
+        payload = data["payload"]
+        header = payload["ChangeEventHeader"]
+        # Update events only carry changed fields, so this is the approval itself
+        if header["changeType"] in ("CREATE", "UPDATE") and (
+            payload.get("Status") == APPROVED_TO_SHIP
+        ):
+            # Raises on a Salesforce error, so the event is retried rather than
+            # read as an order that is no longer approved
+            bodies = self.salesforce.fetch_orders_by_ids(header["recordIds"])
+            if bodies:
+                self.on_orders(bodies)
+        cursor_store.set(f"replay:{ORDER_CHANGE_CHANNEL}", replay_id)
+
+    def handle_account_event(self, data, replay_id):
+        payload = data["payload"]
+        header = payload["ChangeEventHeader"]
+        if header["changeType"] == "CREATE" and payload.get("Name"):
+            body = self.salesforce.build_inflow_customer_body(payload["Name"])
+            self.on_customers([body])
+        cursor_store.set(f"replay:{ACCOUNT_CHANGE_CHANNEL}", replay_id)
@@ -0,0 +1,145 @@
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import (
+    HTTP_BACKOFF_FACTOR,
+    HTTP_CONNECT_TIMEOUT_SECONDS,
+    HTTP_MAX_RETRIES,
+    HTTP_POOL_MAXSIZE,
+    HTTP_READ_TIMEOUT_SECONDS,
+    METRICS_ENABLED,
+)
+from metrics import counter, histogram
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_READ_TIMEOUT_SECONDS)
+# Every write we make is keyed by an id we generate, so PUT/PATCH are safe to replay
+RETRY_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "PATCH", "DELETE"])
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# For hosts whose 429s go back through a rate limiter instead
+LIMITED_RETRY_STATUSES = (500, 502, 503, 504)
+# Record ids, UUIDs and query locators all carry digits and run 8+ chars
+ID_SEGMENT = re.compile(r"^(?=[^/]*\d)[\w-]{8,}$")
+
+
+def endpoint_template(url):
+    parts = urlsplit(url)
+    path = "/".join(
+        "{id}" if ID_SEGMENT.match(segment) else segment
+        for segment in parts.path.split("/")
+    )
+    return parts.netloc, path
+
+
+def body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    return 0
+
+
+def record_request(method, url, seconds, status=None, sent=0, received=0):
+    # status None means the call failed without a response
+    host, endpoint = endpoint_template(url)
+    labels = {"host": host, "method": method.upper(), "endpoint": endpoint}
+    histogram("http_client_request_duration_seconds", **labels).observe(seconds)
+    counter(
+        "http_client_requests_total",
+        status="error" if status is None else str(status),
+        **labels,
+    ).inc()
+    if status is None or status >= 400:
+        counter("http_client_errors_total", **labels).inc()
+    counter("http_client_request_bytes_total", **labels).inc(sent)
+    counter("http_client_response_bytes_total", **labels).inc(received)
+
+
+class TimeoutSession(requests.Session):
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+        if not METRICS_ENABLED:
+            return super().request(method, url, **kwargs)
+        started_at = time.perf_counter()
+        try:
+            response = super().request(method, url, **kwargs)
+        except Exception:
+            record_request(method, url, time.perf_counter() - started_at)
+            raise
+        seconds = time.perf_counter() - started_at
+        received = response.headers.get("Content-Length")
+        if received is None and not kwargs.get("stream"):
+            received = len(response.content)
+        record_request(
+            method,
+            url,
+            seconds,
+            response.status_code,
+            body_size(response.request.body),
+            int(received or 0),
+        )
+        return response
+
+
+class StatusRetry(Retry):
+    # urllib3 also retries a 413, 429 or 503 carrying Retry-After whatever the
+    # forcelist says, so only honour the header for statuses we retry
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code not in self.status_forcelist:
+            has_retry_after = False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def build_session(retry_statuses=RETRY_STATUSES):
+    retry = StatusRetry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        backoff_jitter=HTTP_BACKOFF_FACTOR,
+        status_forcelist=retry_statuses,
+        allowed_methods=RETRY_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_MAXSIZE,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = TimeoutSession()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(host, retry_statuses=RETRY_STATUSES):
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            logger.info(f"Opening HTTP session for {host}")
+            session = build_session(retry_statuses)
+            _sessions[host] = session
+        return session
+
+
+def close_sessions():
+    # Pooled sockets must not be inherited across a fork, or parent and
+    # children would all talk over the same connection
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def request(method, url, **kwargs):
+    return get_session(urlsplit(url).netloc).request(method, url, **kwargs)
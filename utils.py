@@ -1,8 +1,62 @@
-def variables_nonetype_conversion_to_string(*variables):
-    result = []
-    for variable in variables:
-        if variable is None:
-            result.append("")
-        else:
-            result.append(variable)
-    return result
\ No newline at end of file
+import fcntl
+import json
+import os
+from datetime import datetime
+from config import STATE_DIR
+
+
+def empty_if_none(value):
+    return "" if value is None else value
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def soql_datetime(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.") + f"{dt.microsecond // 1000:03d}Z"
+
+
+def parse_salesforce_timestamp(ts):
+    return datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S.%f%z")
+
+
+def parse_inflow_timestamp(ts):
+    # Inflow returns 7 fractional digits, fromisoformat only accepts up to 6
+    if len(ts) == 31:
+        trimmed_iso_str = ts[:25] + "0" + ts[-6:]
+    else:
+        trimmed_iso_str = ts[:26] + ts[-6:]
+    return datetime.fromisoformat(trimmed_iso_str)
+
+
+def load_state(name, default=None):
+    path = os.path.join(STATE_DIR, f"{name}.json")
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def save_state(name, value):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    path = os.path.join(STATE_DIR, f"{name}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def try_lock_state(name):
+    # Non-blocking exclusive lock on STATE_DIR/<name>.lock. It is held while
+    # the returned file stays open and released when the process exits.
+    os.makedirs(STATE_DIR, exist_ok=True)
+    lock_file = open(os.path.join(STATE_DIR, f"{name}.lock"), "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
@@ -0,0 +1,89 @@
+import queue
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class WebhookQueue:
+    def __init__(self, handler, maxsize, workers, on_failure=None) -> None:
+        self.handler = handler
+        self.on_failure = on_failure
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._threads = []
+        self.enqueued = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"webhook-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, payload):
+        try:
+            self.queue.put_nowait((time.monotonic(), payload))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            logger.warning(f"Webhook queue full, rejecting event: {payload}")
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _work(self):
+        while True:
+            enqueued_at, payload = self.queue.get()
+            wait_seconds = time.monotonic() - enqueued_at
+            try:
+                self.handler(payload)
+                is_successful = True
+            except Exception as e:
+                logger.exception(f"Error processing webhook event {payload}: {e}")
+                is_successful = False
+                self.hand_off(payload)
+            finally:
+                self.queue.task_done()
+            with self._lock:
+                if is_successful:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+                self.total_wait_seconds += wait_seconds
+                self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def hand_off(self, payload):
+        # The event was acknowledged already, so Inflow won't send it again
+        if self.on_failure is None:
+            return
+        try:
+            self.on_failure(payload)
+        except Exception as e:
+            logger.exception(f"Could not hand off webhook event {payload}: {e}")
+
+    def stats(self):
+        with self._lock:
+            handled = self.processed + self.failed
+            avg_wait_seconds = self.total_wait_seconds / handled if handled else 0.0
+            return {
+                "depth": self.queue.qsize(),
+                "capacity": self.queue.maxsize,
+                "workers": self.workers,
+                "enqueued": self.enqueued,
+                "rejected": self.rejected,
+                "processed": self.processed,
+                "failed": self.failed,
+                "avg_wait_seconds": avg_wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+            }